@@ -4,11 +4,12 @@
 
 import argparse
 import collections
+import json
 import sys
 import traceback
 
 import httpolice
-from httpolice import inputs, reports
+from httpolice import codings, inputs, parse, reports
 from httpolice.exchange import check_exchange
 from httpolice.notice import Severity
 from httpolice.util.text import stdio_as_bytes
@@ -33,14 +34,50 @@ def parse_args(argv):
                              u'have been reported')
     parser.add_argument(u'--full-traceback', action='store_true',
                         help=u'do not hide the traceback on exceptions')
+    parser.add_argument(u'--memo-size', metavar=u'N', type=int,
+                        help=u'remember up to N parsed values '
+                             u'(or N per grammar symbol '
+                             u'with --memo-per-symbol)')
+    parser.add_argument(u'--memo-per-symbol', action='store_true',
+                        help=u'remember parsed values '
+                             u'separately for each grammar symbol')
+    parser.add_argument(u'--memo-file', metavar=u'PATH',
+                        help=u'remember parsed values between runs '
+                             u'in this file')
+    parser.add_argument(u'--max-header-length', metavar=u'N', type=int,
+                        help=u'do not check header values '
+                             u'longer than N bytes (0 for no limit)')
+    parser.add_argument(u'--max-parse-items', metavar=u'N', type=int,
+                        help=u'stop parsing a header value '
+                             u'after creating N Earley items (0 for no limit)')
+    parser.add_argument(u'--max-decoded-size', metavar=u'N', type=int,
+                        help=u'do not check compressed bodies that expand '
+                             u'to more than N bytes (0 for no limit)')
+    parser.add_argument(u'--max-decoding-ratio', metavar=u'N', type=int,
+                        help=u'do not check compressed bodies that expand '
+                             u'more than N times (0 for no limit)')
+    parser.add_argument(u'--profile-grammar', choices=[u'text', u'json'],
+                        help=u'print how much parsing work was done '
+                             u'for each header to stderr')
     parser.add_argument(u'path', nargs='+')
     return parser.parse_args(argv[1:])
 
 
 def run_cli(args, stdout, stderr):
+    if args.memo_size is not None or args.memo_per_symbol:
+        parse.configure_memo(limit=args.memo_size,
+                             fail_limit=args.memo_size,
+                             per_symbol=args.memo_per_symbol)
+    parse.configure_limits(max_length=args.max_header_length,
+                           max_items=args.max_parse_items)
+    codings.configure_limits(max_size=args.max_decoded_size,
+                             max_ratio=args.max_decoding_ratio)
+    if args.profile_grammar:
+        parse.start_profiling()
     input_ = inputs.formats[args.input]
     report = reports.formats[args.output]
     n_notices = collections.Counter()
+    disk_memo = None
     def generate_exchanges():
         for exch in input_(args.path):
             if args.silence:
@@ -52,6 +89,9 @@ def run_cli(args, stdout, stderr):
             yield exch
 
     try:
+        if args.memo_file:
+            disk_memo = parse.DiskMemo(args.memo_file)
+            parse.share_memo(disk_memo, limit=None)
         # We can't use stdout opened as text (as in Python 3)
         # because it may not be UTF-8 (especially on Windows).
         # Our HTML reports are meant for redirection
@@ -67,6 +107,13 @@ def run_cli(args, stdout, stderr):
             traceback.print_exc(file=stderr)
         stderr.write('httpolice: %s\n' % exc)
         return 1
+    finally:
+        if disk_memo is not None:
+            parse.share_memo(None)
+            disk_memo.close()
+        if args.profile_grammar:
+            write_profile(args.profile_grammar, stderr)
+            parse.stop_profiling()
 
     if args.fail_on is not None:
         for severity in Severity:
@@ -75,6 +122,21 @@ def run_cli(args, stdout, stderr):
     return 0
 
 
+def write_profile(format_, stderr):
+    stats = parse.profile_stats()
+    if format_ == u'json':
+        stderr.write(json.dumps(stats, indent=2) + '\n')
+    else:
+        columns = [u'calls', u'hits', u'misses', u'bytes', u'items', u'steps']
+        stderr.write(u'%-30s%10s%10s%10s%12s%12s%12s%10s\n' %
+                     tuple([u'symbol'] + columns + [u'time']))
+        for counters in stats:
+            stderr.write(u'%-30s%10d%10d%10d%12d%12d%12d%10.3f\n' %
+                         tuple([counters[u'symbol']] +
+                               [counters[c] for c in columns] +
+                               [counters[u'time']]))
+
+
 def excepthook(_type, exc, _traceback):     # pragma: no cover
     sys.stderr.write('httpolice: unhandled exception: %r\n' % exc)
 
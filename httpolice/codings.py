@@ -2,20 +2,145 @@
 
 """Decoding content and transfer codings."""
 
-import gzip
-import io
+import re
 import zlib
 
 import brotli
 
 
+# A small compressed body can expand to gigabytes ("decompression bomb"),
+# so we decompress it bit by bit, and give up when the output grows too big,
+# either absolutely or relative to the input.
+# The ratio limit only applies to outputs longer than `_RATIO_MIN_SIZE`,
+# because small bodies (like a long run of spaces) can legitimately
+# compress very well, and cannot hurt anyway.
+
+MAX_SIZE = 100 * 1024 * 1024
+MAX_RATIO = 100
+
+_max_size = MAX_SIZE
+_max_ratio = MAX_RATIO
+
+_RATIO_MIN_SIZE = 1024 * 1024
+
+# How much to decompress at a time.
+_PIECE_SIZE = 64 * 1024
+
+# How much compressed input to feed to zlib at first.
+_FIRST_PIECE_SIZE = 256
+
+# How much compressed input to feed to brotli at a time.
+# Its decompressor has no way to limit the output of one call,
+# so this limits it indirectly.
+_BROTLI_PIECE_SIZE = 256
+
+
+def configure_limits(max_size=None, max_ratio=None):
+    """Change the limits on decoding compressed bodies.
+
+    A body that exceeds these limits is not decoded:
+    :exc:`DecodingLimitError` is raised instead
+    (and the body becomes unavailable, with notice 1300).
+
+    :param max_size:
+        The maximum size of a decoded body, in bytes.
+    :param max_ratio:
+        The maximum ratio of a decoded body's size to its encoded size
+        (only checked for bodies longer than 1 MB).
+
+    Zero disables a limit. Parameters that are `None` are left unchanged.
+    """
+    # pylint: disable=global-statement
+    global _max_size, _max_ratio
+    if max_size is not None:
+        _max_size = max_size
+    if max_ratio is not None:
+        _max_ratio = max_ratio
+
+
+class DecodingLimitError(Exception):
+
+    """Raised when decoding a body would exceed the limits."""
+
+    def __init__(self, size):
+        super(DecodingLimitError, self).__init__(
+            u'gave up after decoding %d bytes' % size)
+        self.size = size
+
+
+class _Output(object):
+
+    def __init__(self, input_size):
+        self.pieces = []
+        self.size = 0
+        limits = [_max_size]
+        if _max_ratio:
+            limits.append(max(input_size * _max_ratio, _RATIO_MIN_SIZE))
+        self.max_size = min(limit for limit in limits if limit) \
+            if any(limits) else None
+
+    def append(self, piece):
+        self.pieces.append(piece)
+        self.size += len(piece)
+        if self.max_size and self.size > self.max_size:
+            raise DecodingLimitError(self.size)
+
+    def join(self):
+        return b''.join(self.pieces)
+
+
+def _decompress_zlib(data, pos, wbits, output):
+    # Decompress the stream that starts at `pos` in `data`,
+    # and return the position where it ends.
+    decompressor = zlib.decompressobj(wbits)
+    # Feed the input in pieces, too, because the ``unconsumed_tail``
+    # is a copy of the rest of the input. Likewise, the ``unused_data``
+    # after the end of the stream is a copy of the rest of the piece,
+    # so the pieces start small, in case the stream is short.
+    size = _FIRST_PIECE_SIZE
+    while pos < len(data):
+        tail = data[pos : pos + size]
+        pos += len(tail)
+        while tail:
+            output.append(decompressor.decompress(tail, _PIECE_SIZE))
+            tail = decompressor.unconsumed_tail
+        if decompressor.unused_data:
+            return pos - len(decompressor.unused_data)
+        size = min(size * 2, _PIECE_SIZE)
+    output.append(decompressor.flush())
+    # On Python 2, there is no ``eof``, so a truncated stream goes unnoticed.
+    if not getattr(decompressor, 'eof', True):
+        raise zlib.error('incomplete or truncated stream')
+    return pos
+
+
+_non_zero_re = re.compile(b'[^\\x00]')
+
+
 def decode_gzip(data):
-    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    output = _Output(len(data))
+    # A gzip file can consist of several "members",
+    # possibly padded with zeros.
+    pos = 0
+    while pos < len(data):
+        pos = _decompress_zlib(data, pos, 16 + zlib.MAX_WBITS, output)
+        if _non_zero_re.search(data, pos) is None:
+            break
+    return output.join()
 
 
 def decode_deflate(data):
-    return zlib.decompress(data)
+    output = _Output(len(data))
+    _decompress_zlib(data, 0, zlib.MAX_WBITS, output)
+    return output.join()
 
 
 def decode_brotli(data):
-    return brotli.decompress(data)
+    output = _Output(len(data))
+    decompressor = brotli.Decompressor()
+    data = bytes(data)                  # It doesn't take `memoryview`.
+    for i in range(0, len(data), _BROTLI_PIECE_SIZE):
+        output.append(decompressor.decompress(
+            data[i : i + _BROTLI_PIECE_SIZE]))
+    output.append(decompressor.finish())
+    return output.join()
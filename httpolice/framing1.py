@@ -5,12 +5,14 @@
 import re
 
 from httpolice.citation import RFC
-from httpolice.codings import decode_deflate, decode_gzip
+from httpolice.codings import (DecodingLimitError, decode_deflate,
+                               decode_gzip)
 from httpolice.exchange import Exchange, complaint_box
 from httpolice.known import m, st, tc
 from httpolice.parse import ParseError, Symbol
 from httpolice.request import Request
 from httpolice.response import Response
+from httpolice.stream import BufferStream, NeedMoreData
 from httpolice.structure import (FieldName, HeaderEntry, HTTPVersion, Method,
                                  StatusCode, Unavailable, okay)
 
@@ -60,11 +62,7 @@ def parse_streams(inbound, outbound, scheme=None):
         if req:
             if outbound and outbound.good:
                 (resps, resp_box) = _parse_responses(outbound, req)
-                if resps:
-                    if resps[-1].status == st.switching_protocols:
-                        inbound.sane = False
-                    if req.method == m.CONNECT and resps[-1].status.successful:
-                        inbound.sane = False
+                _check_switch(inbound, req, resps)
             yield Exchange(req, resps)
         if req_box:
             yield req_box
@@ -92,6 +90,185 @@ def parse_streams(inbound, outbound, scheme=None):
         yield complaint_box(1010, stream=outbound, offset=outbound.tell())
 
 
+INBOUND = u'inbound'
+OUTBOUND = u'outbound'
+
+
+class IncrementalParser(object):
+
+    """Parse HTTP/1.x streams as their data arrives.
+
+    This is the same as :func:`parse_streams`, but instead of reading
+    from whole streams, it is fed pieces of data as they come in
+    (for example, from a proxy or a network tap), and returns exchanges
+    as soon as they are complete. It does no I/O of its own.
+
+    A message is parsed from its beginning when enough data has arrived,
+    so the data of one message is buffered until the message is complete.
+    To bound memory use, a stream is abandoned (with notice 1007 or 1010)
+    if more than `max_buffer_size` bytes of it are waiting to be parsed.
+    Unlike with :func:`parse_streams`, this includes the message
+    that was being parsed, even if its body alone is within the limits.
+
+    :param scheme:
+        The scheme of the request URI, as a Unicode string,
+        or `None` if unknown.
+    :param inbound_name:
+        The name of the inbound (request) stream, for reports.
+    :param outbound_name:
+        The name of the outbound (response) stream, for reports.
+    :param max_buffer_size:
+        The maximum number of unparsed bytes to keep for each stream.
+    """
+
+    def __init__(self, scheme=None, inbound_name=u'inbound',
+                 outbound_name=u'outbound', max_buffer_size=MAX_BODY_SIZE):
+        self.scheme = scheme
+        self.max_buffer_size = max_buffer_size
+        self.inbound = BufferStream(inbound_name)
+        self.outbound = BufferStream(outbound_name)
+        self._streams = {INBOUND: self.inbound, OUTBOUND: self.outbound}
+        self._done = set()
+        # The request whose responses we are waiting for, and the responses
+        # so far. `None` as the request means "parsing responses on their own".
+        self._pending = None
+        self._complained_1008 = False
+
+    def feed(self, direction, data):
+        """Add `data` (bytes) to the stream in `direction`.
+
+        :param direction: :data:`INBOUND` or :data:`OUTBOUND`.
+        :return: A list of :class:`Exchange` objects that are now complete.
+        """
+        stream = self._streams[direction]
+        if stream in self._done:
+            return []
+        stream.feed(data)
+        exchanges = self._advance()
+        if stream.buffered > self.max_buffer_size:
+            stream.sane = False
+            exchanges.extend(self._advance())
+        return exchanges
+
+    def feed_eof(self, direction):
+        """Mark the end of the stream in `direction`.
+
+        :return: A list of :class:`Exchange` objects that are now complete.
+        """
+        self._streams[direction].feed_eof()
+        return self._advance()
+
+    def close(self):
+        """Mark the end of both streams.
+
+        :return: A list of the remaining :class:`Exchange` objects.
+        """
+        self.inbound.feed_eof()
+        self.outbound.feed_eof()
+        return self._advance()
+
+    def _advance(self):
+        exchanges = []
+        while self._step(exchanges):
+            pass
+        for stream in [self.inbound, self.outbound]:
+            if stream in self._done:
+                stream.close()
+            else:
+                stream.discard()
+        return exchanges
+
+    def _step(self, exchanges):
+        # Do the next thing that `parse_streams` would do, if we can.
+        # Return `True` if something was done.
+        (inbound, outbound) = (self.inbound, self.outbound)
+
+        if self._pending is not None:
+            (req, resps) = self._pending
+            if _has_data(outbound):
+                r = outbound.attempt(_parse_response, outbound, req)
+                if r is None:
+                    return False
+                (resp, resp_box) = r
+                if resp:
+                    resps.append(resp)
+                if resp_box or _is_final(resp):
+                    self._finish_exchange(exchanges)
+                    if resp_box:
+                        exchanges.append(resp_box)
+                return True
+            elif not _is_good(outbound):
+                self._finish_exchange(exchanges)
+                return True
+            return False
+
+        if inbound not in self._done:
+            if _has_data(inbound):
+                r = inbound.attempt(_parse_request, inbound, self.scheme)
+                if r is None:
+                    return False
+                (req, req_box) = r
+                if req:
+                    self._pending = (req, [])
+                if req_box:
+                    exchanges.append(req_box)
+                return True
+            return self._finish_stream(inbound, 1007, exchanges)
+
+        if outbound not in self._done:
+            if _has_data(outbound):
+                if not self._complained_1008:
+                    # We had some requests, but we ran out of them.
+                    exchanges.append(complaint_box(1008, stream=outbound))
+                    self._complained_1008 = True
+                self._pending = (None, [])
+                return True
+            return self._finish_stream(outbound, 1010, exchanges)
+
+        return False
+
+    def _finish_exchange(self, exchanges):
+        (req, resps) = self._pending
+        self._pending = None
+        if req:
+            _check_switch(self.inbound, req, resps)
+            exchanges.append(Exchange(req, resps))
+        elif resps:
+            exchanges.append(Exchange(None, resps))
+
+    def _finish_stream(self, stream, notice_id, exchanges):
+        if _is_good(stream):
+            return False                # Waiting for more data.
+        if stream.sane or stream.at_eof and not stream.buffered:
+            self._done.add(stream)
+            return True
+        if stream.buffered:
+            # Some data remains on the stream, but we can't parse it.
+            exchanges.append(complaint_box(notice_id, stream=stream,
+                                           offset=stream.tell()))
+            self._done.add(stream)
+            return True
+        return False                    # Don't know yet if any data remains.
+
+
+def _has_data(stream):
+    return stream.sane and stream.buffered > 0
+
+
+def _is_good(stream):
+    return stream.sane and not (stream.at_eof and not stream.buffered)
+
+
+def _check_switch(inbound, req, resps):
+    # After these responses, the rest of the inbound stream
+    # is no longer HTTP/1.x.
+    if resps:
+        if resps[-1].status == st.switching_protocols:
+            inbound.sane = False
+        if req.method == m.CONNECT and resps[-1].status.successful:
+            inbound.sane = False
+
+
 def _parse_request(stream, scheme=None):
     try:
         req = _parse_request_heading(stream, scheme)
@@ -166,20 +343,31 @@ def _parse_responses(stream, req):
     while stream.good:
         # Parse all responses corresponding to one request.
         # RFC 7230 section 3.3.
-        try:
-            resp = _parse_response_heading(req, stream)
-        except ParseError as e:
-            return (resps, complaint_box(1009, error=e))
-        else:
-            resps.append(resp)
-            _parse_response_body(resp, stream)
-            if (not resp.status.informational) or \
-                    (resp.status == st.switching_protocols):
-                # This is the final response for this request.
-                break
+        (resp, resp_box) = _parse_response(stream, req)
+        if resp_box:
+            return (resps, resp_box)
+        resps.append(resp)
+        if _is_final(resp):
+            break
     return (resps, None)
 
 
+def _parse_response(stream, req):
+    try:
+        resp = _parse_response_heading(req, stream)
+    except ParseError as e:
+        return (None, complaint_box(1009, error=e))
+    else:
+        _parse_response_body(resp, stream)
+        return (resp, None)
+
+
+def _is_final(resp):
+    # Is this the final response for its request?
+    return (not resp.status.informational) or \
+        (resp.status == st.switching_protocols)
+
+
 def _parse_response_heading(req, stream):
     beginning = stream.tell()
     with stream.parsing(status_line):
@@ -246,6 +434,82 @@ def parse_header_fields(stream):
     :return: A list of :class:`HeaderEntry`.
     :raises: :class:`ParseError`
     """
+    entries = _parse_header_block(stream)
+    if entries is None:
+        entries = _parse_header_lines(stream)
+    return entries
+
+
+# Header blocks longer than this are left to `_parse_header_lines`.
+_MAX_FAST_BLOCK = 64 * 1024
+
+
+def _parse_header_block(stream):
+    # A fast path for the common case: the whole header block is in memory
+    # and has no errors, so we can split it into lines all at once.
+    # Returns `None` to fall back to `_parse_header_lines`,
+    # which will then report any errors.
+    buf = stream.buffer()
+    if buf is None:
+        return None
+    (data, pos) = buf
+    first = data[pos : pos + 1]
+    if first == b'\r' or first == b'\n':
+        return []
+
+    # The block ends before the first line that begins with CR or LF.
+    limit = pos + _MAX_FAST_BLOCK
+    cr = data.find(b'\n\r', pos, limit)
+    lf = data.find(b'\n\n', pos, limit if cr == -1 else cr)
+    end = cr if lf == -1 else lf
+    if end == -1:
+        return None
+    lines = bytes(data[pos : end + 1]).split(b'\n')
+    lines.pop()                         # The empty string after the last LF.
+
+    fields = []
+    complaints = []
+    for line in lines:
+        if len(line) >= stream.max_line_length:
+            return None
+        folded = fields and line[:1] in (b' ', b'\t')
+        if folded:
+            complaints.append(1016)
+        if line[-1:] == b'\r':
+            line = line[:-1]
+        else:
+            complaints.append(1224)
+        if folded:
+            fields[-1][1].append(b' ' + line.lstrip(b' \t'))
+        else:
+            (name, colon, v) = line.partition(b':')
+            if not colon:
+                return None
+            fields.append((name, [v]))
+
+    for notice_id in complaints:
+        stream.complain(notice_id)
+    stream.skip(end + 1 - pos)
+    return [HeaderEntry._make((_field_name(name),
+                               b''.join(vs).strip(b' \t')))
+            for (name, vs) in fields]
+
+
+_field_names = {}
+
+
+def _field_name(raw):
+    # The same few dozen header names occur over and over,
+    # so we keep them decoded.
+    name = _field_names.get(raw)
+    if name is None:
+        name = FieldName(raw.decode('iso-8859-1'))
+        if len(_field_names) < 1000:
+            _field_names[raw] = name
+    return name
+
+
+def _parse_header_lines(stream):
     entries = []
     while stream.peek() not in [b'\r', b'\n', b'']:
         with stream.parsing(header_field):
@@ -270,23 +534,26 @@ def _decode_transfer_coding(msg, coding):
         msg.complain(1002)
         msg.body = Unavailable(msg.body)
     elif coding == tc.gzip or coding == tc.x_gzip:
-        try:
-            msg.body = decode_gzip(msg.body)
-        except Exception as e:
-            msg.complain(1027, coding=coding, error=e)
-            msg.body = Unavailable(msg.body)
+        _decode_with(msg, coding, decode_gzip)
     elif coding == tc.deflate:
-        try:
-            msg.body = decode_deflate(msg.body)
-        except Exception as e:
-            msg.complain(1027, coding=coding, error=e)
-            msg.body = Unavailable(msg.body)
+        _decode_with(msg, coding, decode_deflate)
     else:
         if okay(coding):
             msg.complain(1003, coding=coding)
         msg.body = Unavailable(msg.body)
 
 
+def _decode_with(msg, coding, decoder):
+    try:
+        msg.body = decoder(msg.raw_body)
+    except DecodingLimitError as e:
+        msg.complain(1300, coding=coding, error=e)
+        msg.body = Unavailable(msg.body)
+    except Exception as e:
+        msg.complain(1027, coding=coding, error=e)
+        msg.body = Unavailable(msg.body)
+
+
 class BodyTooLongError(Exception):
 
     def __init__(self, size, max_size):
@@ -297,7 +564,6 @@ class BodyTooLongError(Exception):
 
 
 def _parse_chunk(stream, data):
-    current_size = sum(len(c) for c in data)
     with stream.parsing(chunk):
         pos = stream.tell()
         (size_s, _, _) = stream.readline().partition(u';')
@@ -308,24 +574,41 @@ def _parse_chunk(stream, data):
                 raise stream.error(pos)
         if size == 0:
             return False
-        elif size + current_size > MAX_BODY_SIZE:
+        elif size + len(data) > MAX_BODY_SIZE:
             stream.sane = False
-            raise BodyTooLongError(size + current_size, MAX_BODY_SIZE)
+            raise BodyTooLongError(size + len(data), MAX_BODY_SIZE)
         else:
-            data.append(stream.read(size))
+            data += stream.read(size)
             stream.readlineend()
             return True
 
 
 def _parse_chunked(msg, stream):
-    data = []
+    # Some streaming responses consist of a great many tiny chunks,
+    # so we accumulate them in one buffer, which also keeps track of the size.
+    # While such a response is still arriving (see `IncrementalParser`),
+    # we don't want to go over all the chunks again on every attempt,
+    # so we resume after the last complete chunk of the previous attempt.
+    start = stream.tell()
+    n_complaints = len(stream.complaints)
+    (data, size, complaints) = stream.resume(start) or (bytearray(), 0, [])
+    del data[size:]
+    stream.complaints.extend(complaints)
     place = u'chunked framing'
+    checkpoint = (start, size, len(stream.complaints))
     try:
-        while _parse_chunk(stream, data):
-            pass
+        while True:
+            checkpoint = (stream.tell(), len(data), len(stream.complaints))
+            if not _parse_chunk(stream, data):
+                break
         trailer = parse_header_fields(stream)
         with stream.parsing(chunked_body):
             stream.readlineend()
+    except NeedMoreData:
+        (pos, size, n) = checkpoint
+        stream.suspend(start, pos,
+                       (data, size, stream.complaints[n_complaints:n]))
+        raise
     except ParseError as e:
         msg.complain(1005, error=e)
         msg.body = Unavailable()
@@ -334,7 +617,7 @@ def _parse_chunked(msg, stream):
         msg.body = Unavailable()
     else:
         stream.dump_complaints(msg.complain, place=place)
-        msg.body = b''.join(data)
+        msg.body = bytes(data)
         msg.trailer_entries = trailer
         if trailer:
             msg.rebuild_headers()           # Rebuild the `HeadersView` cache
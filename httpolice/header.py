@@ -21,7 +21,7 @@ import sys
 
 from httpolice import known
 from httpolice.known import HeaderRule, h
-from httpolice.parse import parse
+from httpolice.parse import parse, parse_many
 from httpolice.structure import Parametrized, Unavailable, okay
 from httpolice.syntax.rfc7230 import quoted_string, token
 from httpolice.util.data import duplicates
@@ -134,21 +134,29 @@ class HeaderView(object):
         values = []
         items = self.message.headers.enumerate(self.name)
         syntax = known.header.syntax_for(self.name)
-        for from_trailer, i, entry in items:
-            if from_trailer and known.header.is_bad_for_trailer(self.name):
+        bad_for_trailer = known.header.is_bad_for_trailer(self.name)
+        if syntax is not None:
+            # We don't need the annotations here (see
+            # :attr:`httpolice.message.Message.annotated_header_entries`),
+            # but collecting them costs next to nothing, and this way
+            # the memoized parse results can be reused for them later.
+            results = iter(parse_many(
+                [entry.value for (from_trailer, _, entry) in items
+                 if not (from_trailer and bad_for_trailer)],
+                syntax, 1000, annotate_classes=known.classes))
+        for from_trailer, _, entry in items:
+            if from_trailer and bad_for_trailer:
                 self.message.complain(1026, entry=entry)
                 continue
             entries.append(entry)
             if syntax is None:
                 parsed = entry.value
             else:
-                (parsed, annotations) = parse(
-                    entry.value, syntax,
-                    self.message.complain, 1000, place=entry,
-                    annotate_classes=known.classes)
+                ((parsed, _), complaints) = next(results)
+                for (notice_id, context) in complaints:
+                    self.message.complain(notice_id, place=entry, **context)
                 if not isinstance(parsed, Unavailable):
                     parsed = self._process_parsed(entry, parsed)
-                    self.message.annotations[(from_trailer, i)] = annotations
             values.append(parsed)
         return entries, values
 
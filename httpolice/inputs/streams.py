@@ -4,6 +4,7 @@ from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 import io
 import itertools
+import mmap
 import os
 import re
 
@@ -12,7 +13,7 @@ import six
 from httpolice.exchange import complaint_box
 from httpolice.framing1 import parse_streams
 from httpolice.inputs.common import InputError, decode_path
-from httpolice.stream import Stream
+from httpolice.stream import MappedStream, Stream
 
 
 def streams_input(paths):
@@ -206,29 +207,35 @@ def _path_pairs_input(path_pairs, sniff_direction=False,
 
 
 def _parse_paths(inbound_path, outbound_path, scheme=u'http'):
-    inbound_file = outbound_file = None
+    inbound = outbound = None
 
     try:
         if inbound_path:
-            inbound_file = io.open(inbound_path, 'rb')
-            inbound = Stream(inbound_file, name=decode_path(inbound_path))
-        else:
-            inbound = None
-
+            inbound = _open_stream(inbound_path)
         if outbound_path:
-            outbound_file = io.open(outbound_path, 'rb')
-            outbound = Stream(outbound_file, name=decode_path(outbound_path))
-        else:
-            outbound = None
+            outbound = _open_stream(outbound_path)
 
         for exch in parse_streams(inbound, outbound, scheme):
             yield exch
 
     finally:
-        if inbound_file is not None:
-            inbound_file.close()
-        if outbound_file is not None:
-            outbound_file.close()
+        if inbound is not None:
+            inbound.close()
+        if outbound is not None:
+            outbound.close()
+
+
+def _open_stream(path):
+    # Captures of big downloads can take gigabytes,
+    # so we map the file into memory instead of reading it.
+    # This doesn't work for empty files, nor for pipes and such.
+    name = decode_path(path)
+    with io.open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return Stream(io.open(path, 'rb'), name=name)
+    return MappedStream(mapped, name=name)
 
 
 def _rearrange_by_time(sequences):
@@ -383,9 +390,9 @@ def parse_combined(path):
         raise InputError('%s: bad combined file: no outbound marker' % path)
     (inbound_data, outbound_data) = parts2
 
-    inbound = Stream(io.BufferedReader(io.BytesIO(inbound_data)),
-                     name=decode_path(path) + u' (inbound)')
-    outbound = Stream(io.BufferedReader(io.BytesIO(outbound_data)),
-                      name=decode_path(path) + u' (outbound)')
+    inbound = MappedStream(inbound_data,
+                           name=decode_path(path) + u' (inbound)')
+    outbound = MappedStream(outbound_data,
+                            name=decode_path(path) + u' (outbound)')
 
     return (inbound, outbound, scheme, preamble)
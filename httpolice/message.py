@@ -8,17 +8,17 @@ import json
 from six.moves.urllib.parse import parse_qs  # pylint: disable=import-error
 import xml.etree.ElementTree
 
-from bitstring import Bits
 import defusedxml
 import defusedxml.ElementTree
 import six
 
 from httpolice import known
 from httpolice.blackboard import Blackboard, derived_property
-from httpolice.codings import decode_brotli, decode_deflate, decode_gzip
+from httpolice.codings import (DecodingLimitError, decode_brotli,
+                               decode_deflate, decode_gzip)
 from httpolice.header import HeadersView
 from httpolice.known import cc, h, media, tc, upgrade, warn
-from httpolice.parse import parse
+from httpolice.parse import ParseError, parse
 from httpolice.structure import (FieldName, HeaderEntry, HTTPVersion,
                                  Unavailable, http2, http11, okay)
 from httpolice.syntax import rfc7230
@@ -30,7 +30,7 @@ from httpolice.util.text import force_unicode, format_chars, printable
 # as the exhaustive list of bytes that can be output
 # by a "conformant" URL encoder.
 
-URL_ENCODED_GOOD_BYTES = Bits(
+URL_ENCODED_GOOD_BYTES = bytearray(
     1 if (x in [0x25, 0x26, 0x2A, 0x2B, 0x2D, 0x2E, 0x5F] or
           0x30 <= x < 0x40 or 0x41 <= x < 0x5B or 0x61 <= x < 0x7B) else 0
     for x in range(256)
@@ -54,26 +54,54 @@ class Message(Blackboard):
         self.trailer_entries = [HeaderEntry(k, v)
                                 for k, v in trailer_entries or []]
         self.rebuild_headers()
-        self.annotations = {}
         self.remark = remark
 
+    # Annotations are only needed for HTML reports, so instead of storing them
+    # for every message, we get them here on demand. This is cheap because
+    # the headers have just been parsed (with the same `known.classes`)
+    # when checking the message, and :func:`httpolice.parse.parse`
+    # has memoized the results.
+
     @property
     def annotated_header_entries(self):
-        return [(entry, self.annotations.get((False, i), [entry.value]))
-                for i, entry in enumerate(self.header_entries)]
+        return [(entry, _annotate(entry, from_trailer=False))
+                for entry in self.header_entries]
 
     @property
     def annotated_trailer_entries(self):
-        return [(entry, self.annotations.get((True, i), [entry.value]))
-                for i, entry in enumerate(self.trailer_entries)]
+        return [(entry, _annotate(entry, from_trailer=True))
+                for entry in self.trailer_entries]
 
     def rebuild_headers(self):
         self.headers = HeadersView(self)
 
+    # Bodies read by :class:`httpolice.stream.MappedStream` are
+    # :class:`memoryview` slices of the input file. Checks that don't need
+    # the actual bytes (only the length, or the decoded text) use `raw_body`,
+    # so that a body is copied into memory only if something asks for `body`.
+
+    @property
+    def body(self):
+        if isinstance(self._body, memoryview):
+            self._body = self._body.tobytes()
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+
+    @property
+    def raw_body(self):
+        """The payload body as a byte string or some other bytes-like object.
+
+        This is the same as `body`, but without copying.
+        """
+        return self._body
+
     @derived_property
     def decoded_body(self):
-        """The payload body with Content-Encoding removed."""
-        r = self.body
+        """The payload body with Content-Encoding removed, as bytes."""
+        r = self.raw_body
         codings = self.headers.content_encoding.value[:]
         while codings and okay(r) and r:
             coding = codings.pop()
@@ -84,14 +112,20 @@ class Message(Blackboard):
             if decoder is not None:
                 try:
                     r = decoder(r)
+                except DecodingLimitError as e:
+                    self.complain(1300, coding=coding, error=e)
+                    r = Unavailable(bytes(r))
                 except Exception as e:
                     self.complain(1037, coding=coding, error=e)
-                    r = Unavailable(r)
+                    r = Unavailable(bytes(r))
             elif okay(coding):
                 self.complain(1036, coding=coding)
-                r = Unavailable(r)
+                r = Unavailable(bytes(r))
             else:
-                r = Unavailable(r)
+                r = Unavailable(bytes(r))
+        if isinstance(r, memoryview):
+            # Not decoded at all, but callers expect a byte string.
+            r = self.body
         return r
 
     @derived_property
@@ -108,7 +142,7 @@ class Message(Blackboard):
 
         if okay(self.decoded_body):
             try:
-                self.decoded_body.decode(charset)   # pylint: disable=no-member
+                codecs.decode(self.decoded_body, charset)
             except UnicodeError:
                 return None
         return charset
@@ -119,8 +153,7 @@ class Message(Blackboard):
             return self.decoded_body
         if not okay(self.guessed_charset):
             return Unavailable(self.decoded_body)
-        # pylint: disable=no-member
-        return self.decoded_body.decode(self.guessed_charset)
+        return codecs.decode(self.decoded_body, self.guessed_charset)
 
     @derived_property
     def content_is_full(self):
@@ -200,8 +233,7 @@ class Message(Blackboard):
                     char = six.int2byte(byte)
                     self.complain(1040, char=format_chars([char]))
                     return Unavailable(self.decoded_body)
-            # pylint: disable=no-member
-            return parse_qs(self.decoded_body.decode('ascii'))
+            return parse_qs(codecs.decode(self.decoded_body, 'ascii'))
         else:
             return None
 
@@ -228,11 +260,10 @@ class Message(Blackboard):
             r = self.unicode_body
             transforms = removing_te + removing_ce + decoding_charset
         elif okay(self.decoded_body):
-            # pylint: disable=no-member
-            r = self.decoded_body.decode('utf-8', 'replace')
+            r = codecs.decode(self.decoded_body, 'utf-8', 'replace')
             transforms = removing_te + removing_ce
-        elif okay(self.body):
-            r = self.body.decode('utf-8', 'replace')
+        elif okay(self.raw_body):
+            r = codecs.decode(self.raw_body, 'utf-8', 'replace')
             transforms = removing_te
         else:
             return self.body, []
@@ -262,6 +293,20 @@ class Message(Blackboard):
         raise NotImplementedError()
 
 
+def _annotate(entry, from_trailer):
+    syntax = known.header.syntax_for(entry.name)
+    if syntax is not None and \
+            not (from_trailer and known.header.is_bad_for_trailer(entry.name)):
+        try:
+            (_, annotated) = parse(entry.value, syntax,
+                                   annotate_classes=known.classes)
+        except (ParseError, UnicodeError):
+            pass
+        else:
+            return annotated
+    return [entry.value]
+
+
 def check_message(msg):
     """Run all checks that apply to any message (both request and response)."""
     complain = msg.complain
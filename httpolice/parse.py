@@ -40,13 +40,24 @@ The ``<<`` operator (:meth:`Symbol.__rlshift__`)
 ensures this automatically for most classes.
 """
 
+from array import array
+import bisect
 from collections import OrderedDict
+import functools
+import hashlib
+import importlib
+import json
 import operator
+import os
+import pkgutil
+import sys
+import threading
+from timeit import default_timer
 
-from bitstring import BitArray, Bits
 import six
-from six.moves import range
+from six.moves import cPickle as pickle, range
 
+from httpolice.__metadata__ import version as httpolice_version
 from httpolice.structure import Unavailable
 from httpolice.util.text import format_chars
 
@@ -59,7 +70,7 @@ def parse(data, symbol, complain=None, fail_notice_id=None,
     """(Try to) parse a string as a grammar symbol.
 
     Uses memoization internally, so parsing the same strings many times isn't
-    expensive.
+    expensive, whether they are valid or not.
 
     :param data:
         The bytestring or Unicode string to parse. Unicode will be encoded
@@ -91,50 +102,745 @@ def parse(data, symbol, complain=None, fail_notice_id=None,
 
     """
     annotate_classes = tuple(annotate_classes or ())        # for `isinstance`
+    (r, complaints, annotated) = _parse(data, symbol, fail_notice_id,
+                                        annotate_classes)
+    if complain is not None:
+        for (notice_id, context) in complaints:
+            context = dict(extra_context, **context)
+            complain(notice_id, **context)
+    if annotate_classes:
+        return (r, annotated)
+    else:
+        return r
+
+
+def parse_many(values, symbol, fail_notice_id=None, annotate_classes=None):
+    """Parse many strings as the same grammar symbol.
 
+    This is like calling :func:`parse` on each of `values`,
+    but every distinct value is only looked up and parsed once.
+
+    :return:
+        A list with a pair for each of `values`, in the same order:
+        what :func:`parse` would return for it, and the list of complaints
+        that :func:`parse` would pass to `complain`,
+        as ``(notice_id, context)`` tuples.
+
+    :raises:
+        Same as :func:`parse`, on the first failing value.
+    """
+    annotate_classes = tuple(annotate_classes or ())
+    parsed = {}
+    results = []
+    for data in values:
+        result = parsed.get(data)
+        if result is None:
+            (r, complaints, annotated) = _parse(data, symbol, fail_notice_id,
+                                                annotate_classes)
+            if annotate_classes:
+                r = (r, annotated)
+            result = parsed[data] = (r, complaints)
+        results.append(result)
+    return results
+
+
+def _parse(data, symbol, fail_notice_id, annotate_classes):
+    profiler = _profiler
+    if profiler is None:
+        return _parse_memoized(data, symbol, fail_notice_id, annotate_classes)
+    token = profiler.start(symbol, data)
+    try:
+        return _parse_memoized(data, symbol, fail_notice_id, annotate_classes)
+    finally:
+        profiler.stop(token)
+
+
+def _parse_memoized(data, symbol, fail_notice_id, annotate_classes):
     if not isinstance(data, bytes):
         try:
             data = data.encode('iso-8859-1')
         except UnicodeError as e:
             if fail_notice_id is None:      # pragma: no cover
                 raise
-            complain(fail_notice_id, error=e, **extra_context)
-            r = Unavailable(data)
-            return (r, None) if annotate_classes else r
+            return (Unavailable(data), [(fail_notice_id, {'error': e})], None)
 
     # Check if we have already memoized this.
-    key = (data, symbol, annotate_classes)
-    parse_result = _memo.pop(key, None)
-    if parse_result is not None:
-        _memo[key] = parse_result       # Reinsertion maintains LRU order.
-    else:
-        try:
-            parse_result = _inner_parse(data, symbol.as_nonterminal(),
-                                        annotate_classes)
-        except ParseError as e:
+    key = (data, annotate_classes)
+    parse_result = _memo.get(symbol, key)
+    if parse_result is None:
+        # Failures do not depend on `annotate_classes`,
+        # so they are memoized separately, under a shorter key.
+        error = _fail_memo.get(symbol, data)
+        if error is None and not (_max_length and len(data) > _max_length):
+            # The shared memo may have been filled with other limits.
+            parse_result = _get_shared(symbol, key)
+        if error is None and parse_result is None:
+            if _profiler is not None:
+                _profiler.miss(symbol)
+            try:
+                parse_result = _fresh_parse(data, symbol, annotate_classes)
+            except ParseError as e:
+                error = e
+                # The traceback refers to the parser's frames,
+                # which would keep the whole chart alive in the memo.
+                error.__traceback__ = error.__context__ = None
+                _fail_memo.put(symbol, data, error)
+            else:
+                _memo.put(symbol, key, parse_result)
+                _put_shared(symbol, key, parse_result)
+        elif error is None:
+            _memo.put(symbol, key, parse_result)
+
+        if error is not None:
             if fail_notice_id is None:
-                raise
-            complaint = (fail_notice_id, {'error': e})
+                # The same `error` may be raised many times,
+                # so don't let it accumulate tracebacks.
+                six.reraise(ParseError, error)
+            if isinstance(error, ParseLimitError):
+                # This is not a syntax error, so it gets its own notice.
+                complaint = (1299, {'error': error})
+            else:
+                complaint = (fail_notice_id, {'error': error})
             parse_result = (Unavailable(data), [complaint], [])
-        else:
-            _memo[key] = parse_result
-            while len(_memo) > MEMO_LIMIT:
-                _memo.popitem()
 
     (r, complaints, annotations) = parse_result
-    if complain is not None:
-        for (notice_id, context) in complaints:
-            context = dict(extra_context, **context)
-            complain(notice_id, **context)
     if annotate_classes:
-        return (r, _splice_annotations(data, annotations))
+        return (r, complaints, _splice_annotations(data, annotations))
     else:
-        return r
+        return (r, complaints, None)
+
+
+def _fresh_parse(data, symbol, annotate_classes):
+    if _max_length and len(data) > _max_length:
+        raise ParseLimitError(u'Not parsing a value longer than %d bytes.' %
+                              _max_length)
+
+    fast = _fast_paths.get(symbol) if _fast_paths_enabled else None
+    fast_result = None if fast is None else fast(data)
+    if fast_result is not None:
+        (r, complaints, annotations) = fast_result
+        fast_result = (r, complaints,
+                       [(start, end, obj) for (start, end, obj) in annotations
+                        if isinstance(obj, annotate_classes)])
+        if not _verify_fast_paths:
+            return fast_result
+
+    try:
+        parse_result = _inner_parse(data, symbol.as_nonterminal(),
+                                    annotate_classes, charts=_chart_memo)
+    except ParseError:
+        if fast_result is not None:
+            raise AssertionError(u'fast path for %r accepts %r '
+                                 u'but the grammar does not' % (symbol, data))
+        raise
+    if fast_result is not None:
+        (r1, complaints1, annotations1) = fast_result
+        (r2, complaints2, annotations2) = parse_result
+        # Compare the ``repr`` too, because the ``==`` of some classes
+        # (such as :class:`~httpolice.structure.Parametrized`) is lenient.
+        if not (r1 == r2 and repr(r1) == repr(r2) and
+                complaints1 == complaints2 and
+                _splice_annotations(data, annotations1) ==
+                _splice_annotations(data, annotations2)):
+            raise AssertionError(u'fast path for %r parses %r as %r '
+                                 u'instead of %r' % (symbol, data,
+                                                     fast_result, parse_result))
+    return parse_result
+
+
+class Memo(object):
+
+    """A size-limited store of parse results that evicts least recently used.
+
+    If `per_symbol` is true, every grammar symbol gets its own partition
+    of `limit` entries. Thus, high-cardinality headers (like ``Date``)
+    cannot flush the results for stable ones (like ``Content-Type``).
+    Otherwise, there is one shared partition of `limit` entries.
+
+    A memo can be used from several threads at once.
+    """
+
+    def __init__(self, limit, per_symbol=False):
+        self.limit = limit
+        self.per_symbol = per_symbol
+        self.hits = self.misses = self.evictions = 0
+        self._partitions = {}
+        # Even a lookup reorders the entries, so every access is locked.
+        # The critical sections are tiny, and the GIL would serialize them
+        # anyway, so there is no point in finer-grained locking.
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(part) for part in self._partitions.values())
+
+    def _partition_key(self, symbol, key):
+        if self.per_symbol:
+            return (symbol, key)
+        else:
+            return (None, (symbol, key))
+
+    def get(self, symbol, key):
+        (part_key, key) = self._partition_key(symbol, key)
+        with self._lock:
+            part = self._partitions.get(part_key)
+            value = None if part is None else part.pop(key, None)
+            if value is None:
+                self.misses += 1
+            else:
+                part[key] = value           # Reinsertion maintains LRU order.
+                self.hits += 1
+            return value
+
+    def put(self, symbol, key, value):
+        (part_key, key) = self._partition_key(symbol, key)
+        with self._lock:
+            part = self._partitions.setdefault(part_key, OrderedDict())
+            part[key] = value
+            while len(part) > self.limit:
+                self._evict(part)
+                self.evictions += 1
+
+    def _evict(self, part):
+        part.popitem(last=False)            # The least recently used.
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def configure(self, limit=None, per_symbol=None):
+        """Change the size limit and/or partitioning. Clears the memo."""
+        with self._lock:
+            if limit is not None:
+                self.limit = limit
+            if per_symbol is not None:
+                self.per_symbol = per_symbol
+            self.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'size': len(self), 'limit': self.limit,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class ChartMemo(Memo):
+
+    """A size-limited store of Earley charts that can be searched by prefix.
+
+    The Earley chart up to position `i` only depends on the first `i` bytes
+    of the input. Header values often differ only at the end
+    (``max-age=3600, public`` vs. ``max-age=60, public``),
+    so parsing can resume from the chart of the longest stored prefix,
+    even when the whole-value memo misses.
 
+    Charts for inputs longer than `max_length` are not stored,
+    because they would take too much memory.
+    """
+
+    max_length = 1024
+
+    def __init__(self, limit):
+        super(ChartMemo, self).__init__(limit, per_symbol=False)
+        # For every symbol, the inputs stored for it, in sorted order.
+        # The stored input that shares the longest prefix with a given one
+        # is always next to where that one would be in this order.
+        self._sorted = {}
+
+    def find(self, symbol, data):
+        """Find the chart with the longest common prefix for `data`.
+
+        Return a pair: the chart (or `None`) and the length of that prefix.
+        """
+        with self._lock:
+            inputs = self._sorted.get(symbol)
+            (best, best_length) = (None, 0)
+            if inputs:
+                pos = bisect.bisect(inputs, data)
+                for other in inputs[max(pos - 1, 0) : pos + 1]:
+                    length = _common_prefix_length(data, other)
+                    if length > best_length:
+                        (best, best_length) = (other, length)
+            if best is None:
+                self.misses += 1
+                return (None, 0)
+            (chart, end) = self.get(symbol, best)
+            return (chart, min(best_length, end))
+
+    def put(self, symbol, key, value):
+        if 0 < len(key) <= self.max_length and self.limit > 0:
+            with self._lock:
+                inputs = self._sorted.setdefault(symbol, [])
+                pos = bisect.bisect_left(inputs, key)
+                if inputs[pos : pos + 1] != [key]:
+                    inputs.insert(pos, key)
+                super(ChartMemo, self).put(symbol, key, value)
+
+    def _evict(self, part):
+        ((symbol, data), _) = part.popitem(last=False)
+        inputs = self._sorted[symbol]
+        del inputs[bisect.bisect_left(inputs, data)]
+
+    def clear(self):
+        with self._lock:
+            super(ChartMemo, self).clear()
+            self._sorted.clear()
+
+
+def _common_prefix_length(s1, s2):
+    n = min(len(s1), len(s2))
+    i = 0
+    while i < n and s1[i] == s2[i]:
+        i += 1
+    return i
+
+
+MEMO_LIMIT = 5000
+FAIL_MEMO_LIMIT = 500
+CHART_MEMO_LIMIT = 200
+
+_memo = Memo(MEMO_LIMIT)
+
+# Malformed values tend to repeat just as often as good ones
+# (think of one misconfigured server sending the same broken header
+# on every response), and they are even more expensive to parse
+# because of :func:`_build_parse_error`. So we memoize them, too.
+_fail_memo = Memo(FAIL_MEMO_LIMIT)
+
+# Charts take much more memory than parse results, so we keep fewer of them.
+_chart_memo = ChartMemo(CHART_MEMO_LIMIT)
+
+# Pieces matched by automata are parsed again to get their results
+# (see :func:`_parse_match`). We memoize those separately, so that they
+# don't push out the results for whole values or skew :func:`memo_stats`.
+_match_memo = Memo(MEMO_LIMIT)
+
+
+def configure_memo(limit=None, fail_limit=None, per_symbol=None,
+                   chart_limit=None):
+    """Change the sizes of the parse memos.
+
+    :param limit:
+        The maximum number of successful parse results to keep
+        (per grammar symbol if `per_symbol` is true).
+    :param fail_limit:
+        The same for parse failures.
+    :param per_symbol:
+        Whether every grammar symbol gets its own partition of the memos.
+    :param chart_limit:
+        The maximum number of parser states to keep for resuming
+        from a common prefix (see :class:`ChartMemo`).
+        Zero disables this.
+
+    Parameters that are `None` are left unchanged.
+    The memos are cleared.
+    """
+    _memo.configure(limit, per_symbol)
+    _fail_memo.configure(fail_limit, per_symbol)
+    _chart_memo.configure(chart_limit)
+    _match_memo.clear()
+
+
+def memo_stats():
+    """Return the counters for the parse memos, as a dict of dicts."""
+    return {'success': _memo.stats, 'failure': _fail_memo.stats,
+            'chart': _chart_memo.stats}
+
+
+# Worker processes (say, of a :class:`multiprocessing.pool.Pool`)
+# can also share their successful parse results (see :func:`share_memo`).
+_shared_memo = None
+_shared_memo_limit = None
+
+
+def share_memo(mapping, limit=MEMO_LIMIT * 10):
+    """Share successful parse results with other processes via `mapping`.
+
+    `mapping` is consulted whenever the memo of this process misses,
+    and new results are stored into it, as long as it has fewer than
+    `limit` entries (`None` means that `mapping` limits itself).
+    Its keys are tuples and its values are bytestrings.
+    Anything with ``get``, ``__setitem__`` and ``__len__`` will do,
+    such as a :class:`DiskMemo`, but normally this is a ``dict`` proxy from
+    :class:`multiprocessing.Manager`. For example::
+
+      manager = multiprocessing.Manager()
+      pool = multiprocessing.Pool(initializer=httpolice.parse.share_memo,
+                                  initargs=(manager.dict(),))
+
+    Only the results for symbols defined in grammar modules
+    (see :func:`fill_names`), such as the syntax of every known header,
+    are shared, and only if they can be pickled.
+    Pass `None` to stop sharing.
+    """
+    # pylint: disable=global-statement
+    global _shared_memo, _shared_memo_limit
+    (_shared_memo, _shared_memo_limit) = (mapping, limit)
+
+
+def _shared_key(symbol, key):
+    symbol_key = getattr(symbol, 'key', None)
+    if symbol_key is None:
+        return None
+    (data, annotate_classes) = key
+    return (symbol_key, data,
+            tuple(u'%s.%s' % (cls.__module__, cls.__name__)
+                  for cls in annotate_classes))
+
+
+def _get_shared(symbol, key):
+    shared = _shared_memo
+    if shared is None:
+        return None
+    shared_key = _shared_key(symbol, key)
+    if shared_key is None:
+        return None
+    value = shared.get(shared_key)
+    if value is None:
+        return None
+    try:
+        return pickle.loads(value)
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError,
+            AttributeError, ImportError):
+        return None                     # Corrupt, or from another version.
+
+
+def _put_shared(symbol, key, parse_result):
+    shared = _shared_memo
+    if shared is None:
+        return
+    shared_key = _shared_key(symbol, key)
+    if shared_key is None:
+        return
+    if _shared_memo_limit is not None and len(shared) >= _shared_memo_limit:
+        return
+    try:
+        value = pickle.dumps(parse_result, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return                          # Some complaint context, perhaps.
+    shared[shared_key] = value
+
+
+class DiskMemo(object):
+
+    """A store of parse results in an SQLite database file at `path`.
+
+    This can be passed to :func:`share_memo` (with ``limit=None``)
+    to reuse the results of previous runs, which is useful when
+    the same traffic is checked over and over.
+
+    The file is only valid for the exact version of HTTPolice
+    (and of its grammar) that created it;
+    when HTTPolice is upgraded, it is cleared.
+    At most `max_entries` results are kept. The excess is evicted
+    starting with those that have not been used for the most runs.
+    Call :meth:`close` at the end of the run to write everything out.
+
+    Errors reading or writing the file after it has been opened
+    are ignored, as if the results were not found.
+    """
+
+    max_entries = 100000
+
+    def __init__(self, path, max_entries=None):
+        import sqlite3
+        self._sqlite3 = sqlite3
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pending = self._deleted = 0
+        try:
+            version = u'%s-%s-py%d.%d' % (
+                (httpolice_version, _grammar_hash()) +
+                tuple(sys.version_info[:2]))
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript(
+                u'CREATE TABLE IF NOT EXISTS meta (version TEXT);'
+                u'CREATE TABLE IF NOT EXISTS results ('
+                u'  symbol TEXT, data BLOB, classes TEXT, result BLOB,'
+                u'  generation INTEGER,'
+                u'  PRIMARY KEY (symbol, data, classes));')
+            if self._db.execute(u'SELECT version FROM meta').fetchall() != \
+                    [(version,)]:
+                self._db.executescript(u'DELETE FROM meta;'
+                                       u'DELETE FROM results;')
+                self._db.execute(u'INSERT INTO meta VALUES (?)', (version,))
+            # Every run is a new generation. Results used in this run
+            # are moved to it, so they are evicted last.
+            (self._generation, self._size) = self._db.execute(
+                u'SELECT COALESCE(MAX(generation), 0) + 1, COUNT(*) '
+                u'FROM results').fetchone()
+            self._db.commit()
+        except (sqlite3.Error, EnvironmentError) as e:
+            raise IOError(u'cannot open parse memo %s: %s' % (path, e))
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _columns(key):
+        (symbol_key, data, class_names) = key
+        return (symbol_key, _blob(data), u' '.join(class_names))
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    u'SELECT rowid, result, generation FROM results '
+                    u'WHERE symbol = ? AND data = ? AND classes = ?',
+                    self._columns(key)).fetchone()
+                if row is None:
+                    return default
+                (rowid, result, generation) = row
+                if generation != self._generation:
+                    self._db.execute(u'UPDATE results SET generation = ? '
+                                     u'WHERE rowid = ?',
+                                     (self._generation, rowid))
+                    self._written()
+                return bytes(result)
+            except self._sqlite3.Error:
+                return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            try:
+                self._db.execute(
+                    u'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                    self._columns(key) +
+                    (_blob(value), self._generation))
+                self._size += 1
+                if self._size > self.max_entries:
+                    # Evict a bit more than necessary,
+                    # so as not to do this on every new result.
+                    n = self._size - self.max_entries * 9 // 10
+                    self._db.execute(
+                        u'DELETE FROM results WHERE rowid IN ('
+                        u'  SELECT rowid FROM results'
+                        u'  ORDER BY generation, rowid LIMIT ?)', (n,))
+                    self._size -= n
+                    self._deleted += n
+                self._written()
+            except self._sqlite3.Error:
+                pass
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= 1000:           # Don't commit on every write.
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        """Write out all results, compact the file, and close it."""
+        with self._lock:
+            try:
+                self._db.commit()
+                # Reclaim the space freed by evictions, if there was much.
+                if self._deleted > self._size // 4:
+                    self._db.execute(u'VACUUM')
+                self._db.close()
+            except self._sqlite3.Error:
+                pass
+
+
+# On Python 2, SQLite would store a bytestring as text, not as a blob.
+_blob = getattr(six.moves.builtins, 'buffer', bytes)
+
+
+# The Earley algorithm is cubic in the worst case,
+# so a single crafted value could keep the parser busy for a very long time.
+# These limits cap the work done per value (see :func:`configure_limits`).
+MAX_LENGTH = 16 * 1024
+MAX_ITEMS = 0
+_max_length = MAX_LENGTH
+_max_items = MAX_ITEMS
+
+
+def configure_limits(max_length=None, max_items=None):
+    """Change the limits on how much work the parser may do per string.
+
+    A string that exceeds these limits is not parsed at all:
+    :exc:`ParseLimitError` is raised instead (or notice 1299 is reported
+    instead of the usual `fail_notice_id`; see :func:`parse`).
+
+    :param max_length:
+        The maximum length of a string to parse, in bytes.
+    :param max_items:
+        The maximum number of Earley items to create
+        while parsing one string.
+        This is roughly proportional to the time spent.
+
+    Zero disables a limit. Parameters that are `None` are left unchanged.
+    The memos are cleared.
+    """
+    # pylint: disable=global-statement
+    global _max_length, _max_items
+    if max_length is not None:
+        _max_length = max_length
+    if max_items is not None:
+        _max_items = max_items
+    _memo.clear()
+    _fail_memo.clear()
+    _match_memo.clear()
+    # Charts of prefixes count towards `max_items` when resumed,
+    # but they may have been saved under a looser limit.
+    _chart_memo.clear()
+
+
+# Some symbols, like the syntax of ``Content-Length``,
+# are parsed very often and mostly have simple values.
+# They can have hand-written "fast paths" (see :func:`fast_path`).
+_fast_paths = {}
+_fast_paths_enabled = True
+_verify_fast_paths = False
+
+
+def fast_path(symbol):
+    """Decorator that registers a fast path for parsing `symbol`.
+
+    The decorated function is called with a bytestring and must return
+    the same as the Earley parser would for it: a triple of the result,
+    the list of complaints, and the list of annotations as
+    ``(start, end, object)`` for all objects that may need to be annotated.
+    Or it can return `None` if the input is not simple enough for it,
+    and then the Earley parser is used as usual.
+    """
+    def decorate(func):
+        _fast_paths[symbol] = func
+        return func
+    return decorate
+
+
+def configure_fast_paths(enabled=None, verify=None):
+    """Turn fast paths (see :func:`fast_path`) on or off.
+
+    If `verify` is true, then every input accepted by a fast path
+    is also parsed as usual, and :exc:`AssertionError` is raised
+    if the results differ. This is for testing.
+
+    Parameters that are `None` are left unchanged.
+    The memos are cleared.
+    """
+    # pylint: disable=global-statement
+    global _fast_paths_enabled, _verify_fast_paths
+    if enabled is not None:
+        _fast_paths_enabled = enabled
+    if verify is not None:
+        _verify_fast_paths = verify
+    _memo.clear()
+    _fail_memo.clear()
 
-_memo = OrderedDict()
 
-MEMO_LIMIT = 500
+class Profiler(object):
+
+    """Counters of parsing work for every grammar symbol passed to `parse`.
+
+    See :func:`start_profiling`.
+    The counters for a symbol include all the work done on its behalf,
+    such as parsing the pieces matched by automata.
+    It can be used from several threads at once.
+    """
+
+    def __init__(self):
+        self.symbols = OrderedDict()
+        # Running totals, updated directly by the parser.
+        # They are per thread, so that the work done by other threads
+        # doesn't leak into the counters of this thread's symbols.
+        self.running = _RunningTotals()
+        self._lock = threading.Lock()
+
+    def start(self, symbol, data):
+        with self._lock:
+            counters = self.symbols.get(symbol)
+            if counters is None:
+                counters = self.symbols[symbol] = {
+                    'symbol': self._describe(symbol),
+                    'calls': 0, 'hits': 0, 'misses': 0, 'bytes': 0,
+                    'items': 0, 'steps': 0, 'time': 0.0,
+                }
+            counters['calls'] += 1
+            counters['hits'] += 1           # Unless :meth:`miss` is called.
+            counters['bytes'] += len(data)
+        running = self.running
+        return (counters, running.items, running.steps, default_timer())
+
+    def stop(self, token):
+        (counters, items, steps, start_time) = token
+        elapsed = default_timer() - start_time
+        running = self.running
+        with self._lock:
+            counters['time'] += elapsed
+            counters['items'] += running.items - items
+            counters['steps'] += running.steps - steps
+
+    def miss(self, symbol):
+        with self._lock:
+            counters = self.symbols[symbol]
+            counters['hits'] -= 1
+            counters['misses'] += 1
+
+    @staticmethod
+    def _describe(symbol):
+        if symbol.name is not None:
+            return six.text_type(symbol.name)
+        # Describe an anonymous symbol by its rules (only one level deep).
+        return u' | '.join(u' '.join(six.text_type(sym.name or u'...')
+                                     for sym in rule.symbols)
+                           for rule in symbol.as_nonterminal().rules)
+
+    @property
+    def stats(self):
+        with self._lock:
+            counters = [dict(c) for c in self.symbols.values()]
+        return sorted(counters, key=lambda c: c['time'], reverse=True)
+
+
+class _RunningTotals(threading.local):
+
+    items = 0
+    steps = 0
+
+
+_profiler = None
+
+
+def start_profiling():
+    """Start counting the parsing work for every grammar symbol.
+
+    Any previous counters are discarded. Get them with :func:`profile_stats`.
+    """
+    global _profiler                            # pylint: disable=global-statement
+    _profiler = Profiler()
+
+
+def stop_profiling():
+    """Stop counting and discard the counters."""
+    global _profiler                            # pylint: disable=global-statement
+    _profiler = None
+
+
+def profile_stats():
+    """Return the counters collected since :func:`start_profiling`.
+
+    The result is a list of dicts, one per grammar symbol,
+    most expensive (by total time) first:
+
+    ``symbol``
+        The name of the symbol.
+    ``calls``
+        How many times a value was parsed as this symbol.
+    ``hits``, ``misses``
+        How many of those were found in the memo.
+    ``bytes``
+        The total length of those values.
+    ``items``
+        The total number of Earley items created (a measure of work).
+    ``steps``
+        The total number of steps taken to extract the results.
+    ``time``
+        The total wall time in seconds.
+    """
+    return [] if _profiler is None else _profiler.stats
 
 
 def _splice_annotations(data, annotations):
@@ -162,6 +868,11 @@ class ParseError(Exception):
             of :class:`Symbol` as part of which this `description` would be
             expected. `description` may be `None` if an entire symbol was
             expected at that `position` and no further detail is available.
+            Alternatively, a function (taking no arguments) that returns
+            such a list. It will be called when :attr:`expected`
+            is first accessed, because computing it may be expensive.
+            If computing it would exceed the limits
+            (see :func:`configure_limits`), the list is empty.
         :param found:
             A bytestring of length 1 or 0 (for EOF) that was found
             at `position`, or `None` if irrelevant.
@@ -171,9 +882,28 @@ class ParseError(Exception):
             u'unexpected input at byte position %r' % position)
         self.name = name
         self.position = position
-        self.expected = expected
+        self._expected = expected
         self.found = found
 
+    @property
+    def expected(self):
+        if callable(self._expected):
+            self._expected = self._expected()
+        return self._expected
+
+
+class ParseLimitError(ParseError):
+
+    """Parsing was abandoned because it would take too much work.
+
+    See :func:`configure_limits`.
+    """
+
+    def __init__(self, message):
+        super(ParseLimitError, self).__init__(name=None, position=0,
+                                              expected=[])
+        self.args = (message,)
+
 
 ###############################################################################
 # Combinators to construct a grammar suitable for the Earley algorithm.
@@ -221,9 +951,6 @@ class Symbol(object):
     def group(self):
         raise NotImplementedError
 
-    def is_nullable(self):
-        raise NotImplementedError
-
     def as_rule(self):
         raise NotImplementedError
 
@@ -274,17 +1001,23 @@ class Symbol(object):
 
 class Terminal(Symbol):
 
-    """A terminal symbol of the grammar."""
+    """A terminal symbol of the grammar.
 
-    def __init__(self, name=None, citation=None, bits=None):
+    It matches a single byte out of a set
+    represented by a 256-entry lookup `table` (a :class:`bytearray`),
+    where a non-zero entry means that the corresponding byte is accepted.
+    """
+
+    def __init__(self, name=None, citation=None, table=None):
         super(Terminal, self).__init__(name, citation, is_pivot=False)
-        self.bits = bits if bits is not None else Bits(256)
+        self.table = table if table is not None else bytearray(256)
+        self._nonterminal = None
 
     def chars(self):
-        return [six.int2byte(i) for (i, v) in enumerate(self.bits) if v]
+        return [six.int2byte(i) for (i, v) in enumerate(self.table) if v]
 
     def match(self, char):
-        return self.bits[ord(char)]
+        return self.table[ord(char)]
 
     def group(self):
         return self
@@ -296,21 +1029,23 @@ class Terminal(Symbol):
         return [self.as_rule()]
 
     def as_nonterminal(self):
-        return SimpleNonterminal(rules=self.as_rules())
+        # Cache it so that the grammar is only compiled once.
+        if self._nonterminal is None:
+            self._nonterminal = SimpleNonterminal(rules=self.as_rules())
+        return self._nonterminal
 
     def __or__(self, other):
         other = as_symbol(other)
         if isinstance(other, Terminal):
-            return Terminal(bits=self.bits | other.bits)
+            return Terminal(table=bytearray(a or b for (a, b)
+                                            in zip(self.table, other.table)))
         else:
             return super(Terminal, self).__or__(other)
 
     def __sub__(self, other):
         other = as_symbol(other)
-        return Terminal(bits=self.bits ^ (self.bits & other.bits))
-
-    def is_nullable(self):
-        return False
+        return Terminal(table=bytearray(a and not b for (a, b)
+                                        in zip(self.table, other.table)))
 
 
 class Nonterminal(Symbol):
@@ -327,12 +1062,32 @@ class Nonterminal(Symbol):
                  is_ephemeral=None):
         super(Nonterminal, self).__init__(name, citation, is_pivot,
                                           is_ephemeral)
-        self._is_nullable = None
+        # These are filled in by :func:`_compile`.
+        self.is_nullable = None
+        self.first_dots = None
+        self.predictions = None
+        self.predicted = None
+        self.automaton = None
+        self.accept_dot = None
+        # Stable name for the grammar cache, filled in by :func:`fill_names`.
+        self.key = None
+        # Whether this symbol parses to just the string it matches,
+        # even if it has no name (see :func:`string_excluding`).
+        self.is_lexeme = False
 
     @property
     def rules(self):
         raise NotImplementedError
 
+    def __reduce_ex__(self, protocol):
+        # Parse results may contain symbols (see :func:`mark`),
+        # and they need to be pickled for :func:`share_memo`.
+        # The rules can't be pickled, but a symbol defined in a grammar module
+        # can be pickled by reference.
+        if self.key is None:
+            return super(Nonterminal, self).__reduce_ex__(protocol)
+        return (_symbol_by_key, (self.key,))
+
     def as_rule(self):
         if self.is_ephemeral and len(self.rules) == 1:
             return self.rules[0]
@@ -348,13 +1103,6 @@ class Nonterminal(Symbol):
     def as_nonterminal(self):
         return self
 
-    def is_nullable(self):
-        if self._is_nullable is None:
-            self._is_nullable = any(all(sym.is_nullable()
-                                        for sym in rule.symbols)
-                                    for rule in self.rules)
-        return self._is_nullable
-
 
 class SimpleNonterminal(Nonterminal):
 
@@ -474,10 +1222,9 @@ empty = SimpleNonterminal(name=u'empty', rules=[Rule(())], is_ephemeral=True)
 
 def octet_range(min_, max_):
     """Create a terminal that accepts bytes from `min_` to `max_` inclusive."""
-    bits = BitArray(256)
-    for i in range(min_, max_ + 1):
-        bits[i] = True
-    return Terminal(bits=Bits(bits))
+    table = bytearray(256)
+    table[min_ : max_ + 1] = b'\x01' * (max_ + 1 - min_)
+    return Terminal(table=table)
 
 def octet(value):
     """Create a terminal that accepts only the `value` byte."""
@@ -589,6 +1336,17 @@ def string_excluding(terminal, excluding):
 
     This only works when the excluded strings are relatively few and short.
     """
+    # The rules form a trie of the excluded strings.
+    # They are wrapped into a distinct symbol that is compiled into
+    # one automaton (see :func:`_compile`), so the parser doesn't have to
+    # track every branch of the trie separately.
+    r = SimpleNonterminal(rules=_string_excluding(terminal, excluding).rules,
+                          is_ephemeral=False)
+    r.is_lexeme = True
+    return r
+
+
+def _string_excluding(terminal, excluding):
     initials = set(s[0:1].lower() for s in excluding if s)
 
     free = terminal
@@ -598,7 +1356,7 @@ def string_excluding(terminal, excluding):
     r = free + string(terminal)
     for c in initials:
         continuations = [s[1:] for s in excluding if s and s[0:1].lower() == c]
-        r = r | literal(c) + string_excluding(terminal, continuations)
+        r = r | literal(c) + _string_excluding(terminal, continuations)
     if '' not in excluding:
         r = r | subst(u'') << empty
     return r
@@ -635,6 +1393,20 @@ def fill_names(scope, citation):
         if isinstance(x, Symbol) and x.name is _AUTO:
             x.name = name.rstrip('_').replace('_', '-')
             x.citation = citation
+    # A symbol may be imported into other modules (even under other names),
+    # but it keeps the key from the module that was processed first,
+    # which is the one where it was defined.
+    for name, x in sorted(scope.items()):
+        if isinstance(x, Nonterminal) and x.key is None:
+            x.key = u'%s:%s' % (scope.get('__name__'), name)
+            _keyed_symbols.append(x)
+
+_keyed_symbols = []
+
+
+def _symbol_by_key(key):
+    (module_name, name) = key.split(u':')
+    return getattr(importlib.import_module(module_name), name)
 
 
 ###############################################################################
@@ -673,6 +1445,414 @@ def can_complain(func):
     return func
 
 
+###############################################################################
+# Compiling a grammar into tables for the Earley algorithm.
+
+# A grammar never changes after it has been constructed,
+# so before parsing, we "compile" every nonterminal reachable from the target
+# into flat tables that are cheap to consult from the parsing loop.
+# The unit of these tables is the *dotted rule*:
+# a nonterminal, one of its rules, and a position in that rule.
+# Every dotted rule is identified by an integer "dot ID".
+# Dot IDs for all positions of a given rule are consecutive,
+# so advancing an Earley item by one position means adding 1 to its dot ID.
+# Note that one :class:`Rule` object can belong to several nonterminals
+# (see :meth:`Nonterminal.as_rules`), and then it gets several sets of dots.
+
+_dot_symbol = []        # The nonterminal being parsed.
+_dot_rule = []          # The rule by which it is being parsed.
+_dot_next = []          # The symbol after the dot (`None` at the end).
+_dot_kind = []          # What the Earley algorithm does with such an item.
+_dot_plain_kind = []    # The same, but when not using automata (see below).
+
+_COMPLETE = 0           # The dot is at the end of the rule.
+_PREDICT = 1            # The dot is before a nonterminal.
+_SCAN = 2               # The dot is before a terminal.
+_RUN = 3                # The dot is before a nonterminal with an automaton.
+
+# Many symbols, like ``token`` or ``quoted-string``, are actually regular:
+# they could be matched by a regular expression.
+# Parsing them byte by byte with the general Earley machinery is wasteful,
+# so :func:`_compile` turns them into deterministic finite automata.
+# Where such a symbol is expected, the parser just "runs" its automaton
+# along the input, and wherever the automaton accepts,
+# the parser adds a pseudo-item that completes the symbol
+# (its dot is the symbol's ``accept_dot``, with no rule).
+# This way, the chart is much smaller.
+# But the semantic actions of the symbol still need to be applied,
+# so, for every match that ends up in the final parse,
+# :func:`_find_results` parses the matched substring separately
+# (which is cheap thanks to memoization, as such substrings repeat a lot).
+# When details of a parse failure are needed, we reparse without automata
+# (the "plain" mode) to get the same detailed error as before.
+
+_MAX_NFA_STATES = 400
+
+# Earley items are represented as plain integers,
+# with the dot in the low `_DOT_BITS` and the start position above them:
+# ``item == (start << _DOT_BITS) | dot``.
+# This way, the chart doesn't need to allocate a tuple per item,
+# and advancing an item's dot by one symbol is just ``item + 1``.
+
+_DOT_BITS = 20
+_DOT_MASK = (1 << _DOT_BITS) - 1
+
+# Typecode for :class:`array.array` that can hold items.
+# On Python 2, there's no ``q``, but ``l`` is 64 bits on most Unix systems.
+_ITEM_TYPECODE = 'q' if six.PY3 else 'l'
+
+# Guards the grammar tables above, and the lazy construction of automata.
+_compile_lock = threading.RLock()
+
+# Guards :func:`_materialize_leo` on charts that are shared between threads.
+_materialize_lock = threading.Lock()
+
+# On Python 2, running out of stack is just a :exc:`RuntimeError`.
+_RecursionError = getattr(six.moves.builtins, 'RecursionError', RuntimeError)
+
+
+def _compile(target_symbol):
+    # Another thread may be compiling (some of) the same symbols right now,
+    # and a symbol is only usable after all of its batch has been compiled.
+    with _compile_lock:
+        if target_symbol.predictions is None:
+            _compile_new(target_symbol)
+
+
+def _compile_new(target_symbol):
+    # Allocate dots for all nonterminals that have not been compiled yet.
+    first_new_dot = len(_dot_symbol)
+    new_symbols = []
+    stack = [target_symbol]
+    seen = set(stack)
+    while stack:
+        symbol = stack.pop()
+        new_symbols.append(symbol)
+        symbol.first_dots = []
+        for rule in symbol.rules:
+            symbol.first_dots.append(len(_dot_symbol))
+            for next_symbol in rule.xsymbols:
+                if next_symbol is None:
+                    kind = _COMPLETE
+                elif isinstance(next_symbol, Nonterminal):
+                    kind = _PREDICT
+                    if next_symbol.predictions is None and \
+                            next_symbol not in seen:
+                        seen.add(next_symbol)
+                        stack.append(next_symbol)
+                else:
+                    kind = _SCAN
+                _add_dot(symbol, rule, next_symbol, kind)
+
+    # Find out which of them are nullable.
+    # Doing this as a fixed-point computation (rather than recursively)
+    # is robust to left recursion.
+    for symbol in new_symbols:
+        symbol.is_nullable = False
+    changed = True
+    while changed:
+        changed = False
+        for symbol in new_symbols:
+            if not symbol.is_nullable and \
+                    any(all(isinstance(sym, Nonterminal) and sym.is_nullable
+                            for sym in rule.symbols)
+                        for rule in symbol.rules):
+                symbol.is_nullable = True
+                changed = True
+
+    # Find out which of them can be handled by automata,
+    # and switch the dots that predict them to running the automata instead.
+    for symbol in new_symbols:
+        symbol.automaton = _make_automaton(symbol)
+        if symbol.automaton is not None:
+            symbol.accept_dot = _add_dot(symbol, None, None, _COMPLETE)
+    for dot in range(first_new_dot, len(_dot_kind)):
+        if _dot_kind[dot] == _PREDICT and \
+                _dot_next[dot].automaton is not None:
+            _dot_kind[dot] = _RUN
+
+    # Precompute the prediction closures for each of them:
+    # all the dots that end up in the items inventory at some `i`
+    # just because this symbol was predicted at that `i`.
+    # They are listed in the same order as the Earley algorithm
+    # would have added them one by one.
+    # There are two closures: for the plain mode and with automata.
+    closures = [(_closure(symbol, _dot_plain_kind),
+                 _closure(symbol, _dot_kind))
+                for symbol in new_symbols]
+
+    # Only now mark them as compiled, all at once.
+    for symbol, ((plain_dots, plain_predicted),
+                 (dots, predicted)) in zip(new_symbols, closures):
+        symbol.predicted = (plain_predicted, predicted)
+        symbol.predictions = (plain_dots, dots)
+
+
+def _add_dot(symbol, rule, next_symbol, kind):
+    if len(_dot_symbol) > _DOT_MASK:        # pragma: no cover
+        raise RuntimeError(u'grammar is too large')
+    _dot_symbol.append(symbol)
+    _dot_rule.append(rule)
+    _dot_next.append(next_symbol)
+    _dot_kind.append(kind)
+    _dot_plain_kind.append(kind)
+    return len(_dot_kind) - 1
+
+
+def _closure(symbol, dot_kind):
+    dots = []
+    dots_set = set()
+    predicted = set()
+
+    def add(dot):
+        if dot not in dots_set:
+            dots_set.add(dot)
+            dots.append(dot)
+
+    def predict(sym):
+        predicted.add(sym)
+        for dot in sym.first_dots:
+            add(dot)
+
+    predict(symbol)
+    j = 0
+    while j < len(dots):
+        dot = dots[j]
+        if dot_kind[dot] == _PREDICT:
+            next_symbol = _dot_next[dot]
+            if next_symbol.is_nullable:
+                add(dot + 1)
+            if next_symbol not in predicted:
+                predict(next_symbol)
+        j += 1
+
+    return (tuple(dots), frozenset(predicted))
+
+
+class _NotRegular(Exception):
+
+    pass
+
+
+def _make_automaton(symbol):
+    # Only named symbols are worth it, as they can be reused a lot.
+    # Nullable symbols would complicate things (see the "skip" in the parser).
+    # Left-recursive repetitions are handled by their containing symbols.
+    if not _may_have_automaton(symbol):
+        return None
+    if _get_grammar_cache().get(symbol.key) is False:
+        return None
+    nfa = _NFA(symbol)
+    try:
+        (start, accept, has_repetition) = nfa.fragment(symbol, set())
+    except _NotRegular:
+        return None
+    if not has_repetition:
+        # Fixed-length symbols are cheap enough to parse as usual.
+        return None
+    if nfa.has_inner_lexeme:
+        # We only want automata for "lexical" symbols like ``token``,
+        # not for bigger structures that consist of them.
+        # Otherwise, we would parse those bigger structures twice
+        # (the second time in :func:`_parse_match`).
+        return None
+    return _Automaton(nfa, start, accept)
+
+
+def _may_have_automaton(symbol):
+    return ((symbol.name is not None or symbol.is_lexeme) and
+            not symbol.is_nullable and
+            not isinstance(symbol, RepeatedNonterminal))
+
+
+# Most of the time spent in :func:`_compile` goes to trying (and failing)
+# to build automata for symbols that are not regular.
+# Short-lived processes would pay this cost on every run,
+# so the decisions for all symbols of :mod:`httpolice.syntax`
+# are stored in a file that is shipped with the package
+# and regenerated by ``tools/grammar_cache.py``.
+# The rest of the grammar can't be stored, because it contains
+# arbitrary Python functions (semantic actions), but it is cheap to build.
+#
+# Only the "no automaton" decisions are taken on trust:
+# a symbol that is marked as regular is still checked by :class:`_NFA`.
+# So even a wrong cache can only make parsing slower, never incorrect.
+# Still, the cache is ignored if any of the grammar's sources have changed.
+
+GRAMMAR_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'grammar_cache.json')
+
+_grammar_cache = None
+
+
+def _get_grammar_cache():
+    global _grammar_cache                       # pylint: disable=global-statement
+    if _grammar_cache is None:
+        _grammar_cache = load_grammar_cache(GRAMMAR_CACHE_PATH)
+    return _grammar_cache
+
+
+def _grammar_hash():
+    import httpolice.syntax
+    paths = [__file__] + [
+        os.path.join(httpolice.syntax.__path__[0], name + '.py')
+        for (_, name, _) in pkgutil.iter_modules(httpolice.syntax.__path__)]
+    h = hashlib.sha1()
+    for path in paths:
+        with open(os.path.splitext(path)[0] + '.py', 'rb') as f:
+            # Don't be confused by Git's ``core.autocrlf``.
+            h.update(f.read().replace(b'\r\n', b'\n'))
+    return h.hexdigest()
+
+
+def load_grammar_cache(path):
+    """Load the grammar cache from `path`.
+
+    Return a dict that maps the keys of symbols to whether they have automata.
+    If the cache is missing or outdated, the dict is empty.
+    """
+    try:
+        with open(path, 'rb') as f:
+            cache = json.loads(f.read().decode('utf-8'))
+        if cache['hash'] != _grammar_hash():
+            return {}
+        return cache['automata']
+    except (EnvironmentError, ValueError, KeyError):
+        return {}
+
+
+def save_grammar_cache(path):
+    """Compile all of :mod:`httpolice.syntax` and save the cache to `path`."""
+    global _grammar_cache                       # pylint: disable=global-statement
+    _grammar_cache = {}                 # Decide everything from scratch.
+    import httpolice.syntax
+    for (_, name, _) in pkgutil.iter_modules(httpolice.syntax.__path__,
+                                             'httpolice.syntax.'):
+        importlib.import_module(name)
+    for symbol in _keyed_symbols:
+        _compile(symbol)
+    cache = {
+        'hash': _grammar_hash(),
+        'automata': dict((symbol.key, symbol.automaton is not None)
+                         for symbol in _keyed_symbols),
+    }
+    with open(path, 'wb') as f:
+        f.write(json.dumps(cache, indent=0, sort_keys=True).encode('utf-8'))
+        f.write(b'\n')
+
+
+class _NFA(object):
+
+    """A nondeterministic finite automaton built from a regular subgrammar.
+
+    This is the textbook Thompson's construction,
+    where terminals are transitions on bytes
+    and nonterminals are inlined (so they must not be recursive).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.epsilon = []           # State -> list of next states.
+        self.edges = []             # State -> list of (table, next state).
+        self.has_inner_lexeme = False
+
+    def new_state(self):
+        if len(self.edges) >= _MAX_NFA_STATES:
+            raise _NotRegular()
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def fragment(self, symbol, stack):
+        start = self.new_state()
+        accept = self.new_state()
+        has_repetition = False
+        if isinstance(symbol, Terminal):
+            self.edges[start].append((symbol.table, accept))
+        elif symbol in stack:
+            raise _NotRegular()
+        elif isinstance(symbol, RepeatedNonterminal) and \
+                symbol.max_count is None:
+            # Its rules are left-recursive, but this is just a Kleene star.
+            (inner_start, inner_accept, _) = self.fragment(symbol.inner,
+                                                           stack)
+            self.epsilon[start].extend([inner_start, accept])
+            self.epsilon[inner_accept].extend([inner_start, accept])
+            has_repetition = True
+        else:
+            stack = stack | set([symbol])
+            for rule in symbol.rules:
+                state = start
+                for sym in rule.symbols:
+                    (sym_start, sym_accept, sym_has_repetition) = \
+                        self.fragment(sym, stack)
+                    self.epsilon[state].append(sym_start)
+                    state = sym_accept
+                    has_repetition = has_repetition or sym_has_repetition
+                self.epsilon[state].append(accept)
+            if isinstance(symbol, RepeatedNonterminal):
+                has_repetition = True
+            elif has_repetition and symbol is not self.root and \
+                    _may_have_automaton(symbol):
+                self.has_inner_lexeme = True
+        return (start, accept, has_repetition)
+
+    def closure(self, states):
+        r = set(states)
+        stack = list(states)
+        while stack:
+            for next_state in self.epsilon[stack.pop()]:
+                if next_state not in r:
+                    r.add(next_state)
+                    stack.append(next_state)
+        return frozenset(r)
+
+
+class _Automaton(object):
+
+    """A deterministic finite automaton, constructed lazily from an NFA.
+
+    Its states are integers, with 0 being the initial state.
+    ``delta[state][octet]`` is the next state, or :data:`_DEAD`,
+    or `None` if not computed yet (then call :meth:`step`).
+    """
+
+    def __init__(self, nfa, start, accept):
+        self.nfa = nfa
+        self.accept = accept
+        self.subsets = []
+        self.subset_index = {}
+        self.delta = []
+        self.accepting = []
+        self._add_state(nfa.closure([start]))
+
+    def _add_state(self, subset):
+        self.subset_index[subset] = len(self.subsets)
+        self.subsets.append(subset)
+        self.delta.append([None] * 256)
+        self.accepting.append(self.accept in subset)
+        return len(self.subsets) - 1
+
+    def step(self, state, octet_):
+        with _compile_lock:
+            next_states = [next_state
+                           for nfa_state in self.subsets[state]
+                           for (table, next_state) in self.nfa.edges[nfa_state]
+                           if table[octet_]]
+            if next_states:
+                subset = self.nfa.closure(next_states)
+                next_state = self.subset_index.get(subset)
+                if next_state is None:
+                    next_state = self._add_state(subset)
+            else:
+                next_state = _DEAD
+            self.delta[state][octet_] = next_state
+            return next_state
+
+
+_DEAD = -1
+
+
 ###############################################################################
 # The actual Earley parsing algorithms.
 # These are written in a sort of low-level, non-idiomatic Python
@@ -680,115 +1860,322 @@ def can_complain(func):
 # To compensate for this, they are heavily commented.
 
 
-def _add_item(items, items_idx, items_set, symbol, rule, pos, start):
+def _add_item(items, items_idx, items_set, item):
     # `items`, `items_idx` and `items_set` together constitute
     # an inventory of Earley items at a certain position of the input.
-    # ``(symbol, rule, pos, start)`` is the item we want to append to it,
+    # `item` (see `_DOT_BITS`) is the item we want to append to it,
     # unless it's already present there.
 
-    # `items` is the master list that is used for iterating over all items.
+    # `items` is the master array that is used for iterating over all items.
     # `items_idx` is an index of items by their *next symbols*,
     # which speeds up some frequent lookups.
     # `items_set` is the set of all items,
     # which speeds up checking for presence of an item before adding it.
+    # Also, under the special key `_SCAN`, `items_idx` keeps the list of
+    # distinct terminals that items are waiting for, in order of appearance.
+    if item not in items_set:
+        items_set.add(item)
+        items.append(item)
+        dot = item & _DOT_MASK
+        next_symbol = _dot_next[dot]
+        if next_symbol in items_idx:
+            items_idx[next_symbol].append(item)
+        else:
+            items_idx[next_symbol] = [item]
+            if _dot_kind[dot] == _SCAN:
+                items_idx.setdefault(_SCAN, []).append(next_symbol)
 
-    # In fact, `items_set` stores "fingerprints" of items, not actual items.
-    # This makes it faster, as object equality is reduced to integer equality.
-    fingerprint = (id(symbol), id(rule), pos, start)
 
-    if fingerprint not in items_set:
-        items_set.add(fingerprint)
-        items.append((symbol, rule, pos, start))
-        items_idx.setdefault(rule.xsymbols[pos], []).append(
-            (symbol, rule, pos, start))
+def _inner_parse(data, target_symbol, annotate_classes, plain=False,
+                 charts=None):
+    _compile(target_symbol)
 
+    # Local aliases for speed.
+    (dot_symbol, dot_next) = (_dot_symbol, _dot_next)
+    dot_kind = _dot_plain_kind if plain else _dot_kind
+    mode = 0 if plain else 1        # Index into `predictions`.
+    # For `max_items`, the total number of items up to every `i`.
+    (max_items, n_items, counts) = (_max_items, 0, [])
 
-def _inner_parse(data, target_symbol, annotate_classes):
     length = len(data)
-    (items, items_idx, items_set) = ([], {}, set())
-
-    # Seed the initial items inventory with rules for `target_symbol`.
-    chart = [(items, items_idx, items_set)]
-    for rule in target_symbol.rules:
-        _add_item(items, items_idx, items_set, target_symbol, rule, 0, 0)
+    octets = bytearray(data)        # Indexing this gives integers.
+
+    # Every `i` has an inventory of items (see :func:`_add_item`),
+    # a list of automata runs (see :func:`_compile`),
+    # and Leo's transitive items with the completions they skipped
+    # (see :func:`_leo_item`).
+    (items, items_idx, items_set, runs) = (array(_ITEM_TYPECODE), {},
+                                           set(), [])
+
+    # Seed the initial items inventory by predicting `target_symbol`.
+    chart = [(items, items_idx, items_set, runs, {}, [])]
+    for dot in target_symbol.predictions[mode]:
+        _add_item(items, items_idx, items_set, dot)
+    predicted = set(target_symbol.predicted[mode])
+
+    # Or maybe we have already parsed some prefix of `data` (see `ChartMemo`).
+    # Then we can take the chart up to (and including) the end of that prefix,
+    # where the items have been processed but the next byte not yet scanned.
+    # Columns of this chart are shared with other parses
+    # (even in other threads), but only change in ways
+    # that don't depend on the rest of the input
+    # (see :func:`_leo_item` and :func:`_materialize_leo`).
+    # The items of the prefix count towards `max_items`, too, so that
+    # whether a value is parsed doesn't depend on what was parsed before it.
+    first_i = 0
+    if charts is not None:
+        (prefix, first_i) = charts.find(target_symbol, data)
+        if first_i > 0:
+            (prefix_chart, prefix_counts) = prefix
+            chart = prefix_chart[:first_i + 1]
+            counts = prefix_counts[:first_i]
+            n_items = counts[-1]
 
     # Outer loop: over `data`.
-    for i in range(length + 1):
-        token = data[i : i + 1]
-
+    for i in range(first_i, length + 1):
         # Initialize the items inventory for the next `i`,
         # because we will be adding to it on successful scans.
-        chart.append(([], {}, set()))
+        chart.append((array(_ITEM_TYPECODE), {}, set(), [], {}, []))
 
         # Load the items inventory for the current `i`.
-        (items, items_idx, items_set) = chart[i]
-        if len(items) == 0:
+        (items, items_idx, items_set, runs, _, skipped) = chart[i]
+        if len(items) == 0 and len(runs) == 0:
             # This means that there were no successful scans at previous `i`.
             break
 
+        # Symbols whose prediction closure is already in `items`,
+        # or whose automaton has already been started at this `i`.
+        if i > 0:
+            predicted = set()
+
+        # Items predicted at this `i` start at this `i`.
+        base = i << _DOT_BITS
+
         # Inner loop: over items at the current `i`.
-        j = 0
-        while True:
-            (symbol, rule, pos, start) = items[j]
-            next_symbol = rule.xsymbols[pos]
-
-            if next_symbol is None:
-                # Earley completion:
-                # copy items from this rule's start `i` to the current `i`,
-                # advancing their rules by 1 position.
-                (_, items_idx1, _) = chart[start]
-                candidates = items_idx1.get(symbol, [])
-                for (symbol1, rule1, pos1, start1) in candidates:
-                    _add_item(items, items_idx, items_set,
-                              symbol1, rule1, pos1 + 1, start1)
-
-            elif isinstance(next_symbol, Nonterminal):
+        j = len(items) if i == first_i > 0 else 0
+        while j < len(items):
+            item = items[j]
+            dot = item & _DOT_MASK
+            kind = dot_kind[dot]
+
+            if kind == _COMPLETE:
+                start = item >> _DOT_BITS
+                symbol = dot_symbol[dot]
+                # Leo's optimization: if this completion would only
+                # complete another item, and so on up a chain,
+                # add just the topmost item of that chain.
+                # For right recursion, this keeps the chart linear.
+                candidates = chart[start][1].get(symbol, [])
+                top = _leo_item(chart, start, symbol) if start < i else None
+                if top is not None:
+                    if top != candidates[0] + 1:
+                        skipped.append((symbol, start))
+                    _add_item(items, items_idx, items_set, top)
+                else:
+                    # Earley completion:
+                    # copy items from this rule's start `i` to the current `i`,
+                    # advancing their rules by 1 position.
+                    for item1 in candidates:
+                        _add_item(items, items_idx, items_set, item1 + 1)
+
+            elif kind == _PREDICT:
+                next_symbol = dot_next[dot]
                 # Skip over nullable symbols. See:
                 # http://loup-vaillant.fr/tutorials/earley-parsing/empty-rules
-                if next_symbol.is_nullable():
-                    _add_item(items, items_idx, items_set,
-                              symbol, rule, pos + 1, start)
+                if next_symbol.is_nullable:
+                    _add_item(items, items_idx, items_set, item + 1)
                 # Earley prediction:
-                # add rules for `next_symbol` to the current `i`.
-                for next_rule in next_symbol.rules:
-                    _add_item(items, items_idx, items_set,
-                              next_symbol, next_rule, 0, i)
-
-            else:
-                # `next_symbol` is a `Terminal`.
-                # Earley scan:
-                # copy this item to the next `i`,
-                # advancing its rule by 1 position.
-                if token and next_symbol.match(token):
-                    (items1, items_idx1, items_set1) = chart[i + 1]
-                    _add_item(items1, items_idx1, items_set1,
-                              symbol, rule, pos + 1, start)
+                # add the precomputed closure of `next_symbol` to this `i`,
+                # unless we have already done it
+                # (perhaps as part of another symbol's closure).
+                if next_symbol not in predicted:
+                    predicted.update(next_symbol.predicted[mode])
+                    for dot1 in next_symbol.predictions[mode]:
+                        _add_item(items, items_idx, items_set, base | dot1)
+
+            elif kind == _RUN:
+                # Instead of predicting `next_symbol`,
+                # start its automaton from this `i` (see below).
+                next_symbol = dot_next[dot]
+                if next_symbol not in predicted:
+                    predicted.add(next_symbol)
+                    runs.append((next_symbol, i, 0))
+
+            # Otherwise, `next_symbol` is a `Terminal`.
+            # Such items are handled below, all at once.
 
             j += 1
-            if j == len(items):
-                break
+
+        n_items += len(items)
+        counts.append(n_items)
+        if max_items and n_items > max_items:
+            raise ParseLimitError(u'Gave up parsing after %d items.' %
+                                  max_items)
+
+        if i < length:
+            octet_ = octets[i]
+            (items1, items_idx1, items_set1, runs1, _, _) = chart[i + 1]
+
+            # Earley scan:
+            # copy items that expect the next byte to the next `i`,
+            # advancing their rules by 1 position.
+            # Items are indexed by their next symbols, so we only need
+            # one table lookup per distinct terminal, not per item.
+            for terminal in items_idx.get(_SCAN, []):
+                if terminal.table[octet_]:
+                    for item in items_idx[terminal]:
+                        _add_item(items1, items_idx1, items_set1, item + 1)
+
+            # Feed the next byte to all automata that are still running.
+            # If an automaton accepts after this byte, its symbol is complete
+            # (starting from wherever that automaton was started).
+            for (symbol, start, state) in runs:
+                automaton = symbol.automaton
+                next_state = automaton.delta[state][octet_]
+                if next_state is None:
+                    next_state = automaton.step(state, octet_)
+                if next_state != _DEAD:
+                    runs1.append((symbol, start, next_state))
+                    if automaton.accepting[next_state]:
+                        _add_item(items1, items_idx1, items_set1,
+                                  (start << _DOT_BITS) | symbol.accept_dot)
 
     # pylint: disable=undefined-loop-variable
+    if charts is not None:
+        charts.put(target_symbol, data, ((chart, counts), i))
+    if _profiler is not None:
+        _profiler.running.items += sum(len(column[0])
+                                       for column in chart[first_i:])
+
     if i == length:             # Successfully parsed up to the end of stream.
+        # There may be multiple valid parses in case of ambiguities,
+        # but in practice we just want
+        # the first parse that stretches to the beginning of the input.
         results = _find_results(data, target_symbol, chart, i,
-                                [], annotate_classes)
-        for start_i, _, result, complaints, annotations in results:
-            # There may be multiple valid parses in case of ambiguities,
-            # but in practice we just want
-            # the first parse that stretches to the beginning of the input.
-            if start_i == 0:
+                                [], annotate_classes, from_i=0)
+        try:
+            for _, _, result, complaints, annotations in results:
                 return (result, complaints, annotations)
-
-    raise _build_parse_error(data, target_symbol, chart)
+        except _RecursionError:
+            # :func:`_find_results` recurses into nested symbols,
+            # such as comments in ``User-Agent``.
+            raise ParseLimitError(u'Gave up parsing a value '
+                                  u'that is nested too deeply.')
+
+    if plain:
+        raise _build_parse_error(data, target_symbol, chart)
+
+    # The error position is the last `i` where the parse could still go on,
+    # which is the same with or without automata.
+    # But to find out what was expected there, we need to reparse
+    # without automata and walk the chart (see :func:`_build_parse_error`),
+    # which is often not needed at all (for example, in text reports),
+    # so we only do that on demand.
+    position = [i for (i, column) in enumerate(chart)
+                if column[0] or column[3]][-1]
+    raise ParseError(name=None, position=position,
+                     expected=functools.partial(_find_expected,
+                                                data, target_symbol),
+                     found=data[position : position + 1])
+
+
+def _find_expected(data, target_symbol):
+    try:
+        _inner_parse(data, target_symbol, (), plain=True)
+    except ParseLimitError:
+        # Without automata, there are more items, so the limit can be hit
+        # even though the first parse didn't hit it. We don't lift the limit
+        # here, because reports ask for `expected` on any error.
+        return []
+    except ParseError as e:
+        return e.expected
+    return []           # pragma: no cover
+
+
+def _leo_item(chart, i, symbol):
+    # Find the topmost item of the deterministic chain of completions
+    # that starts with completing `symbol` from `i`, or `None` if
+    # there is no such chain (this is Leo's optimization; see
+    # https://doi.org/10.1016/0304-3975(91)90180-A).
+    # The chain continues while there is exactly one item waiting
+    # for the just-completed symbol, and advancing it completes that item.
+    # The results are cached in the `leo` dicts of the chart.
+    # This is iterative (not recursive) because chains can be very long.
+    path = []
+    top = None
+    while True:
+        leo = chart[i][4]
+        if symbol in leo:
+            top = leo[symbol] or top
+            break
+        waiting = chart[i][1].get(symbol, [])
+        if len(waiting) != 1 or \
+                _dot_next[(waiting[0] & _DOT_MASK) + 1] is not None:
+            leo[symbol] = None
+            break
+        path.append((leo, symbol))
+        top = waiting[0] + 1
+        (i, symbol) = (top >> _DOT_BITS, _dot_symbol[top & _DOT_MASK])
+    for (leo, symbol) in path:
+        leo[symbol] = top
+    return top
+
+
+def _materialize_leo(chart, i):
+    # Restore the completed items at `i` that Leo's optimization skipped,
+    # because :func:`_find_results` needs to walk through them.
+    (items, items_idx, items_set, _, _, skipped) = chart[i]
+    if not skipped:
+        return
+    # The chart may be shared with other threads (see `ChartMemo`).
+    with _materialize_lock:
+        for (symbol, start) in skipped:
+            while True:
+                item = chart[start][1][symbol][0] + 1
+                if item in items_set:
+                    # We have reached the topmost item, or a materialized one.
+                    break
+                _add_item(items, items_idx, items_set, item)
+                (symbol, start) = (_dot_symbol[item & _DOT_MASK],
+                                   item >> _DOT_BITS)
+        del skipped[:]
+
+
+def _parse_match(data, symbol, start_i, end_i, annotate_classes):
+    # Parse a substring that was matched by `symbol`'s automaton.
+    piece = data[start_i:end_i]
+    if symbol.is_lexeme:
+        return (piece.decode('iso-8859-1'), [], [])
+    key = (piece, annotate_classes)
+    parse_result = _match_memo.get(symbol, key)
+    if parse_result is None:
+        parse_result = _inner_parse(piece, symbol, annotate_classes)
+        _match_memo.put(symbol, key, parse_result)
+    (result, complaints, annotations) = parse_result
+    annotations = [(start_i + start, start_i + end, obj)
+                   for (start, end, obj) in annotations]
+    return (result, complaints[:], annotations)
 
 
 def _find_results(data, symbol, chart, end_i,
-                  outer_parents, annotate_classes):
+                  outer_parents, annotate_classes, from_i=None, need=None):
+    # Only results that start at `from_i` (if given) are wanted.
+    # Also, if `need` is given, it is the item of the parent rule
+    # with the dot right before `symbol`. Such an item must be present
+    # at the `i` where the result starts, otherwise the previous symbols
+    # of the parent rule cannot fit before it, and there's no point
+    # in computing this result. Without this check, we could explore
+    # an exponential number of dead ends (for example, in right recursion).
+    # So the chart itself serves as a (shared, packed) parse forest.
+
+    if _profiler is not None:
+        _profiler.running.steps += 1
+
     # The trivial base case is to find the parse result of a terminal.
     if isinstance(symbol, Terminal):
-        if end_i > 0:
+        if end_i > 0 and (need is None or need in chart[end_i - 1][2]):
             token = data[end_i - 1 : end_i]
-            if symbol.match(token):
+            if symbol.table[ord(token)]:
                 token = token.decode('iso-8859-1')
                 yield end_i - 1, None, token, [], []
         return
@@ -796,10 +2183,23 @@ def _find_results(data, symbol, chart, end_i,
     # With that out of the way, the interesting story is nonterminals.
 
     # Iterate over all completed items for this nonterminal at this `i`.
-    (_, items_idx, _) = chart[end_i]
+    _materialize_leo(chart, end_i)
+    items_idx = chart[end_i][1]
     for item in items_idx.get(None, []):
-        (sym, rule, _, start_i) = item
-        if sym is not symbol:
+        (dot, start_i) = (item & _DOT_MASK, item >> _DOT_BITS)
+        if _dot_symbol[dot] is not symbol:
+            continue
+        if from_i is not None and start_i != from_i:
+            continue
+        if need is not None and need not in chart[start_i][2]:
+            continue
+        rule = _dot_rule[dot]
+
+        if rule is None:
+            # This is a match of `symbol`'s automaton.
+            (result, complaints, annotations) = _parse_match(
+                data, symbol, start_i, end_i, annotate_classes)
+            yield start_i, item, result, complaints, annotations
             continue
 
         # We don't want to consider items that are
@@ -836,15 +2236,13 @@ def _find_results(data, symbol, chart, end_i,
             n_nodes = len(rule.symbols)
 
         while True:
-            (i, parents, rs, node, complaints, annotations) = frames.pop()
+            (i, parents, rs, _, _, _) = frames.pop()
             if len(frames) == n_nodes:
                 # We found a complete parse for this rule.
-                # It starts at `i`. Is that what we expected?
-                if i != start_i:
-                    # We'll just keep trying other combinations.
-                    continue
-
-                # Great. We have the raw results for each inner symbol.
+                # It starts at `start_i`, because the `need` of its first
+                # symbol is the item with the dot at the start of the rule,
+                # which is only present at the `i` where it was predicted.
+                # So we have the raw results for each inner symbol.
                 # Now we need to do some post-processing.
                 # First, we collect the complaints and annotations
                 # that were produced when parsing these symbols.
@@ -889,10 +2287,17 @@ def _find_results(data, symbol, chart, end_i,
                 if rs is None:
                     if n_nodes is not None:
                         inner_symbol = rule.symbols[-len(frames) - 1]
+                        # The dots of a rule are numbered consecutively.
+                        need_dot = dot - len(frames) - 1
+                    else:
+                        # Every repetition is preceded by the same item
+                        # (the left-recursive `symbol`, then the dot).
+                        need_dot = dot - 1
                     # Recursively get an iterator
                     # over possible results for this symbol.
                     rs = _find_results(data, inner_symbol, chart, i, parents,
-                                       annotate_classes)
+                                       annotate_classes,
+                                       need=(start_i << _DOT_BITS) | need_dot)
 
                 # Get the next result for this symbol.
                 r = next(rs, None)
@@ -937,34 +2342,31 @@ def _find_results(data, symbol, chart, end_i,
                         all_annotations.extend(anns)
                     yield new_i, item, nodes, all_complaints, all_annotations
 
-                if new_i >= start_i:
-                    # Store the result on our stack.
-                    # Also store the iterator,
-                    # so we can come back to it and get further results.
-                    frames.append((i, parents, rs, new_node,
-                                   new_complaints, new_annotations))
-                    # Proceed to the next symbol (at ``pos - 1``)
-                    # and try to find a result for that, ending at `new_i`.
-                    frames.append((new_i, new_parents, None, None, None, None))
-                else:
-                    # This result gets us too far back in the input data.
-                    # But we will try other results from this iterator.
-                    frames.append((i, parents, rs, node,
-                                   complaints, annotations))
+                # Thanks to `need`, the result never starts before `start_i`.
+                # Store it on our stack.
+                # Also store the iterator,
+                # so we can come back to it and get further results.
+                frames.append((i, parents, rs, new_node,
+                               new_complaints, new_annotations))
+                # Proceed to the next symbol (at ``pos - 1``)
+                # and try to find a result for that, ending at `new_i`.
+                frames.append((new_i, new_parents, None, None, None, None))
 
 
 def _build_parse_error(data, target_symbol, chart):
     # Find the last `i` that had some Earley items --
     # that is, the last `i` where we could still make sense of the input data.
-    i, items = [(i, items)
-                for (i, (items, _, _)) in enumerate(chart)
-                if len(items) > 0][-1]
+    i, items = [(i, column[0])
+                for (i, column) in enumerate(chart)
+                if len(column[0]) > 0][-1]
+    _materialize_leo(chart, i)
     found = data[i : i + 1]
 
     # What terminal symbols did we expect at that `i`?
     expected = OrderedDict()
-    for (symbol, rule, pos, start) in items:
-        next_symbol = rule.xsymbols[pos]
+    for item in items:
+        (dot, start) = (item & _DOT_MASK, item >> _DOT_BITS)
+        (symbol, next_symbol) = (_dot_symbol[dot], _dot_next[dot])
         if isinstance(next_symbol, Terminal):
             chars = format_chars(next_symbol.chars())
             # And why did we expect it? As part of what nonterminals?
@@ -985,9 +2387,11 @@ def _find_pivots(chart, symbol, start, stack=None):
         yield symbol
     else:
         stack = (stack or []) + [(symbol, start)]
-        (_, items_idx, _) = chart[start]
+        items_idx = chart[start][1]
         parents = items_idx.get(symbol, [])
-        for (parent, _, _, parent_start) in parents:
+        for item in parents:
+            (parent, parent_start) = (_dot_symbol[item & _DOT_MASK],
+                                      item >> _DOT_BITS)
             if (parent, parent_start) not in stack:
                 for p in _find_pivots(chart, parent, parent_start, stack):
                     yield p
@@ -5,7 +5,7 @@ import six
 
 from httpolice import known, notice
 from httpolice.header import HeaderView
-from httpolice.parse import ParseError, Symbol
+from httpolice.parse import ParseError, ParseLimitError, Symbol
 from httpolice.structure import HeaderEntry, Parametrized
 from httpolice.util.text import format_chars
 
@@ -54,6 +54,10 @@ def expand_header(hdr):
 def expand_error(error):
     return [error]      # A single paragraph consisting of the error message.
 
+@expand_error.register(ParseLimitError)
+def expand_parse_limit_error(error):
+    return [error]      # Not a syntax error, so nothing else to show.
+
 @expand_error.register(ParseError)
 def expand_parse_error(error):
     paras = [[error.name]] if error.name else []
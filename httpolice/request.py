@@ -198,7 +198,7 @@ class Request(message.Message):
         # between "no body" and "empty body",
         # we can reconstruct this distinction later
         # according to the rules of RFC 7230 Section 3.3.
-        if self.body:
+        if self.raw_body:
             return True
         if self.version in [http10, http11]:
             return (self.headers.content_length.is_present or
@@ -212,7 +212,7 @@ def check_request(req):
     method = req.method
     version = req.version
     headers = req.headers
-    body = req.body
+    body = req.raw_body
 
     req.silence(notice_id
                 for (notice_id, in_resp) in headers.httpolice_silence
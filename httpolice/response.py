@@ -109,7 +109,7 @@ class Response(message.Message):
             return False
         if okay(self.request):
             return self.request.method != m.HEAD
-        if self.body:
+        if self.raw_body:
             return True
         return None         # pragma: no cover
 
@@ -206,7 +206,7 @@ def check_response_itself(resp):
     version = resp.version
     status = resp.status
     headers = resp.headers
-    body = resp.body
+    body = resp.raw_body
 
     # Check syntax of reason phrase.
     if okay(resp.reason):
@@ -450,7 +450,7 @@ def check_response_in_context(resp, req):
     method = req.method
     status = resp.status
 
-    if resp.body and resp.headers.content_type.is_absent and \
+    if resp.raw_body and resp.headers.content_type.is_absent and \
             (status != st.partial_content or req.headers.if_range.is_absent):
         complain(1041)
 
@@ -471,7 +471,7 @@ def check_response_in_context(resp, req):
         if u'close' not in resp.headers.connection:
             complain(1047)
 
-    if method == m.HEAD and resp.body:
+    if method == m.HEAD and resp.raw_body:
         complain(1239)
 
     if req.version == http11 and (not req.headers.host.is_okay or
@@ -535,7 +535,7 @@ def check_response_in_context(resp, req):
             resp.headers.location.is_absent:
         complain(1073)
 
-    if method != m.HEAD and resp.body == b'':
+    if method != m.HEAD and resp.raw_body == b'':
         if status == st.accepted:
             complain(1284)
         elif status == st.multiple_choices:
@@ -581,7 +581,7 @@ def check_response_in_context(resp, req):
     if status == st.length_required and req.headers.content_length.is_okay:
         complain(1097)
 
-    if req.body == b'':
+    if req.raw_body == b'':
         if status == st.payload_too_large:
             complain(1098)
 
@@ -1,5 +1,7 @@
 # -*- coding: utf-8; -*-
 
+import six
+
 from httpolice.parse import ParseError
 
 
@@ -53,10 +55,39 @@ class Stream(object):
     def peek(self, n=1):
         return self.file.peek(n)[:n]
 
+    def buffer(self):
+        """Return the stream's data and the current position in it.
+
+        This is `None` unless all the data (read or not) is in memory,
+        in which case the caller can look at it directly
+        and then call :meth:`skip`.
+        """
+        return None
+
+    def resume(self, _key):
+        """Pick up the progress saved by :meth:`BufferStream.suspend`.
+
+        This is `None` unless an earlier attempt to parse the same data
+        ran out of it and saved its progress under the given key.
+        """
+        return None
+
+    def close(self):
+        self.file.close()
+
+    def _read(self, n):
+        return self.file.read(n)
+
+    def _readline(self, limit):
+        return self.file.readline(limit)
+
+    def _at_end(self):
+        return self.peek() == b''
+
     def read(self, n=-1):
         pos = self.tell()
-        r = self.file.read(n)
-        if self.peek() == b'':
+        r = self._read(n)
+        if self._at_end():
             self.eof = True
         if len(r) < n and n > 0:
             raise self.error(pos, expected=u'at least %d bytes' % n)
@@ -64,8 +95,8 @@ class Stream(object):
 
     def readline(self, decode=True):
         pos = self.tell()
-        r = self.file.readline(self.max_line_length)
-        if self.peek() == b'':
+        r = self._readline(self.max_line_length)
+        if self._at_end():
             self.eof = True
         if not r.endswith(b'\n'):
             if len(r) >= self.max_line_length:
@@ -99,3 +130,246 @@ class Stream(object):
             context = dict(extra_context, **context)
             complain_func(notice_id, **context)
         self.complaints[:] = []     # clear
+
+
+class MappedStream(Stream):
+
+    """A :class:`Stream` over data that is already in memory.
+
+    The data can be a byte string or a memory-mapped file (:class:`mmap.mmap`).
+    :meth:`read` returns :class:`memoryview` slices of it,
+    so bodies are not copied until something needs them as bytes
+    (see :attr:`httpolice.message.Message.body`).
+    For a big memory-mapped file, this means that most of it never has to be
+    in the process's own memory, only in the OS page cache.
+
+    On Python 2, where much of the standard library doesn't accept
+    :class:`memoryview`, :meth:`read` returns copies as usual.
+    """
+
+    def __init__(self, data, name=None):
+        super(MappedStream, self).__init__(None, name)
+        self.data = data
+        self.view = memoryview(data) if six.PY3 else data
+        self.pos = 0
+
+    def tell(self):
+        return self.pos
+
+    def peek(self, n=1):
+        return self.data[self.pos : self.pos + n]
+
+    def buffer(self):
+        return (self.data, self.pos)
+
+    def skip(self, n):
+        self.pos += n
+
+    def close(self):
+        if six.PY3:
+            self.view.release()
+        try:
+            self.data.close()
+        except AttributeError:          # Not a memory-mapped file.
+            pass
+        except BufferError:
+            # Some bodies still refer to the mapping.
+            # It will be closed when they are garbage-collected.
+            pass
+
+    def _read(self, n):
+        end = len(self.data) if n < 0 else min(self.pos + n, len(self.data))
+        r = self.view[self.pos : end]
+        self.pos = end
+        return r
+
+    def _readline(self, limit):
+        end = self.data.find(b'\n', self.pos, self.pos + limit)
+        end = min(self.pos + limit, len(self.data)) if end == -1 else end + 1
+        r = self.data[self.pos : end]
+        self.pos = end
+        return r
+
+    def _at_end(self):
+        return self.pos >= len(self.data)
+
+
+class NeedMoreData(Exception):
+
+    """Raised by :class:`BufferStream` when it runs out of buffered data.
+
+    `size` is how many bytes (counting from the beginning of the stream)
+    must be buffered before parsing can succeed, or `None` if that depends
+    on the end of the stream. `exact` is `True` if parsing is likely
+    to succeed as soon as `size` is reached.
+    """
+
+    def __init__(self, size, exact=False):
+        super(NeedMoreData, self).__init__(size)
+        self.size = size
+        self.exact = exact
+
+
+class BufferStream(Stream):
+
+    """A :class:`Stream` over data that arrives bit by bit.
+
+    Data is added with :meth:`feed` until :meth:`feed_eof` is called.
+    Until then, running out of data raises :exc:`NeedMoreData`
+    instead of `ParseError`. :meth:`attempt` catches it and rolls the stream
+    back to where it was, so that parsing can be retried later.
+
+    Retrying from the beginning of a message every time a few more bytes
+    arrive would take quadratic time for a big message that arrives
+    in many pieces (like a long chunked body). So, after a failed attempt,
+    :meth:`ready` waits until the new data is likely to finish the message:
+    until the expected body length is reached, or an empty line
+    (the end of a header block or a chunked body) comes in,
+    or at least as much new data has arrived as was there already.
+    Also, a long parse (like a chunked body) can :meth:`suspend`
+    when it runs out of data, to :meth:`resume` on the next attempt
+    instead of starting over.
+    """
+
+    def __init__(self, name=None):
+        super(BufferStream, self).__init__(None, name)
+        self.data = bytearray()
+        self.base = 0               # Position of `data` in the whole stream.
+        self.pos = 0                # Current position in `data`.
+        self.at_eof = False
+        self._stall = None
+        self._scanned = 0
+        self._empty_line_seen = False
+        self._progress = {}
+
+    def feed(self, data):
+        self.data += data
+
+    def feed_eof(self):
+        self.at_eof = True
+
+    @property
+    def buffered(self):
+        """How many bytes have been fed but not yet parsed."""
+        return len(self.data) - self.pos
+
+    def discard(self):
+        """Forget the data that has already been parsed."""
+        del self.data[:self.pos]
+        self.base += self.pos
+        self.pos = 0
+
+    def tell(self):
+        return self.base + self.pos
+
+    def peek(self, n=1):
+        if self.pos + n > len(self.data):
+            self._need(self.pos + n)
+        return bytes(self.data[self.pos : self.pos + n])
+
+    def buffer(self):
+        return (self.data, self.pos)
+
+    def skip(self, n):
+        self.pos += n
+
+    def resume(self, key):
+        if key not in self._progress:
+            return None
+        (pos, state) = self._progress.pop(key)
+        self.pos = pos - self.base
+        return state
+
+    def suspend(self, key, pos, state):
+        """Save the progress of a parse that is about to raise NeedMoreData.
+
+        On the next attempt, :meth:`resume` with the same `key`
+        will jump to `pos` (counting from the beginning of the stream)
+        and return `state`.
+        """
+        self._progress[key] = (pos, state)
+
+    def close(self):
+        self.data = bytearray()
+        self._progress = {}
+
+    def _need(self, end, exact=False):
+        if not self.at_eof:
+            size = None if end is None else self.base + end
+            raise NeedMoreData(size, exact)
+
+    def _read(self, n):
+        if n < 0:
+            self._need(None)
+            end = len(self.data)
+        else:
+            if self.pos + n > len(self.data):
+                # When we're not inside any syntax, this is a message body
+                # with a known length, so it will be done when it arrives.
+                self._need(self.pos + n,
+                           exact=self._currently_parsing[-1] is None)
+            end = min(self.pos + n, len(self.data))
+        r = bytes(self.data[self.pos : end])
+        self.pos = end
+        return r
+
+    def _readline(self, limit):
+        end = self.data.find(b'\n', self.pos, self.pos + limit)
+        if end == -1:
+            if len(self.data) - self.pos < limit:
+                self._need(len(self.data) + 1)
+            end = min(self.pos + limit, len(self.data))
+        else:
+            end += 1
+        r = bytes(self.data[self.pos : end])
+        self.pos = end
+        return r
+
+    def _at_end(self):
+        return self.at_eof and self.pos >= len(self.data)
+
+    def ready(self):
+        """Is it worth calling :meth:`attempt` again?"""
+        if self._stall is None or self.at_eof:
+            return True
+        (exc, stall_end, consumed) = self._stall
+        end = self.base + len(self.data)
+        if exc.size is None or end < exc.size:
+            return False
+        if exc.exact or end - stall_end >= consumed:
+            return True
+        # Look for an empty line in the data that came after the stall
+        # (plus two bytes before it, in case the line was split).
+        start = max(self._scanned - 2, stall_end - 2) - self.base
+        if not self._empty_line_seen:
+            self._empty_line_seen = (self.data.find(b'\n\r\n', start) != -1 or
+                                     self.data.find(b'\n\n', start) != -1)
+        self._scanned = end
+        return self._empty_line_seen
+
+    def attempt(self, func, *args):
+        """Call ``func(*args)`` unless it needs more data than we have.
+
+        :return:
+            The result of `func`, or `None` if it raised :exc:`NeedMoreData`
+            or if :meth:`ready` says it would anyway.
+        """
+        if not self.ready():
+            return None
+        (pos, sane, n_complaints) = (self.pos, self.sane, len(self.complaints))
+        self.eof = self._at_end()
+        try:
+            r = func(*args)
+        except NeedMoreData as exc:
+            self.pos = pos
+            self.sane = sane
+            self.eof = False
+            del self.complaints[n_complaints:]
+            end = self.base + len(self.data)
+            self._stall = (exc, end, len(self.data) - pos)
+            self._scanned = end
+            self._empty_line_seen = False
+            return None
+        self._stall = None
+        self._progress = {}
+        return r
@@ -1,10 +1,12 @@
 # -*- coding: utf-8; -*-
 
+import re
+
 from httpolice.citation import RFC
-from httpolice.parse import (auto, can_complain, fill_names, group, literal,
-                             many, maybe, maybe_str, named, octet, octet_range,
-                             pivot, recursive, skip, string, string1,
-                             string_excluding, string_times, subst)
+from httpolice.parse import (auto, can_complain, fast_path, fill_names, group,
+                             literal, many, maybe, maybe_str, named, octet,
+                             octet_range, pivot, recursive, skip, string,
+                             string1, string_excluding, string_times, subst)
 from httpolice.structure import (CaseInsensitive, ConnectionOption, FieldName,
                                  Method, MultiDict, Parametrized,
                                  TransferCoding, UpgradeToken, Versioned)
@@ -167,4 +169,74 @@ Via = comma_list1(received_protocol * skip(RWS) *
 
 Content_Length = int << string1(DIGIT)                                  > pivot
 
+
+# Fast paths (see :func:`httpolice.parse.fast_path`) for the simplest cases.
+# Anything that might produce a complaint is left to the full grammar.
+
+_digits_re = re.compile(b'[0-9]+\\Z')
+token_re = re.compile(u"[-!#$%&'*+.^_`|~0-9A-Za-z]+")
+quoted_string_re = re.compile(
+    u'"([\\t \\x21\\x23-\\x5B\\x5D-\\x7E\\x80-\\xFF]*)"')
+_list_separator_re = re.compile(u'[\t ]*,[\t ]*')
+
+
+def fast_comma_list1(element):
+    """Make a fast path for ``comma_list1`` with no empty elements.
+
+    `element` is a function that takes a Unicode string and a position
+    where an element should start. It returns the position
+    where the element ends, its result, and its annotations,
+    or `None` if there is no simple element there.
+    """
+    def parse_list(data):
+        s = data.decode('iso-8859-1')
+        (i, results, annotations) = (0, [], [])
+        while True:
+            r = element(s, i)
+            if r is None:
+                return None
+            (i, result, element_annotations) = r
+            results.append(result)
+            annotations.extend(element_annotations)
+            if i == len(s):
+                return (results, [], annotations)
+            match = _list_separator_re.match(s, i)
+            if match is None:
+                return None
+            i = match.end()
+    return parse_list
+
+
+def fast_token(cls):
+    """Make a fast element (see :func:`fast_comma_list1`) of `cls` tokens."""
+    def parse_token(s, i):
+        match = token_re.match(s, i)
+        if match is None:
+            return None
+        obj = cls(match.group())
+        return (match.end(), obj, [(i, match.end(), obj)])
+    return parse_token
+
+
+@fast_path(Content_Length)
+def _fast_content_length(data):
+    if _digits_re.match(data):
+        return (int(data), [], [])
+    return None
+
+
+def _fast_transfer_coding(s, i):
+    # Only without parameters: then it doesn't matter if it's built-in.
+    r = fast_token(TransferCoding)(s, i)
+    if r is not None:
+        (end, coding, annotations) = r
+        if end == len(s) or s[end] in u'\t ,':
+            return (end, Parametrized(coding, MultiDict()), annotations)
+    return None
+
+
+fast_path(Connection)(fast_comma_list1(fast_token(ConnectionOption)))
+fast_path(Transfer_Encoding)(fast_comma_list1(_fast_transfer_coding))
+
+
 fill_names(globals(), RFC(7230))
@@ -1,22 +1,25 @@
 # -*- coding: utf-8; -*-
 
 from datetime import date, datetime, time
+import re
 
 from httpolice.citation import RFC
 from httpolice.known import media
-from httpolice.parse import (auto, can_complain, fill_names, literal, many,
-                             maybe, maybe_str, named, octet, pivot, skip,
-                             string1, string_times, subst)
+from httpolice.parse import (auto, can_complain, fast_path, fill_names,
+                             literal, many, maybe, maybe_str, named, octet,
+                             pivot, skip, string1, string_times, subst)
 from httpolice.structure import (CaseInsensitive, Charset, ContentCoding,
-                                 MediaType, MultiDict, Parametrized,
+                                 FieldName, MediaType, MultiDict, Parametrized,
                                  ProductName, Unavailable, Versioned, okay)
 from httpolice.syntax.common import DIGIT, SP
 from httpolice.syntax.rfc3986 import URI_reference, absolute_URI
 from httpolice.syntax.rfc4647 import language_range
 from httpolice.syntax.rfc5646 import Language_Tag as language_tag
 from httpolice.syntax.rfc7230 import (OWS, RWS, comma_list, comma_list1,
-                                      comment, field_name, method, partial_URI,
-                                      quoted_string, token, token__excluding)
+                                      comment, fast_comma_list1, fast_token,
+                                      field_name, method, partial_URI,
+                                      quoted_string, quoted_string_re, token,
+                                      token__excluding, token_re)
 
 
 # The standard library's day and month names are locale-dependent,
@@ -248,4 +251,63 @@ Referer = absolute_URI | partial_URI                                    > pivot
 Vary = '*' | comma_list1(field_name)                                    > pivot
 Expect = CaseInsensitive << literal('100-continue')                     > pivot
 
+
+_parameter_re = re.compile(u'[\\t ]*;[\\t ]*(%s)=(?:(%s)|%s)' % (
+    token_re.pattern, token_re.pattern, quoted_string_re.pattern))
+
+@fast_path(Content_Type)
+def _fast_content_type(data):
+    s = data.decode('iso-8859-1')
+    match = token_re.match(s)
+    if match is None or s[match.end() : match.end() + 1] != u'/':
+        return None
+    match = token_re.match(s, match.end() + 1)
+    if match is None:
+        return None
+    mtype = MediaType(s[:match.end()])
+    if mtype in _BAD_MEDIA_TYPES:
+        return None
+    (i, params) = (match.end(), [])
+    while i < len(s):
+        match = _parameter_re.match(s, i)
+        if match is None:
+            return None
+        (name, value, quoted_value) = match.groups()
+        params.append((CaseInsensitive(name),
+                       quoted_value if value is None else value))
+        i = match.end()
+    return (Parametrized(mtype, MultiDict(params)), [],
+            [(0, len(mtype), mtype)])
+
+
+_imf_fixdate_re = re.compile(
+    b'(Mon|Tue|Wed|Thu|Fri|Sat|Sun), ([0-9]{2}) '
+    b'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) ([0-9]{4}) '
+    b'([0-9]{2}):([0-9]{2}):([0-9]{2}) GMT\\Z')
+
+@fast_path(Date)
+def _fast_date(data):
+    match = _imf_fixdate_re.match(data)
+    if match is None:
+        return None
+    (dow, d, m, y, hh, mm, ss) = match.groups()
+    try:
+        r = datetime(int(y), _MONTH_NAMES.index(m.decode('ascii')) + 1, int(d),
+                     int(hh), int(mm), int(ss))
+    except ValueError:
+        return None
+    if _DAY_NAMES[r.weekday()][:3] != dow.decode('ascii'):
+        return None
+    return (r, [], [])
+
+
+_fast_vary = fast_comma_list1(fast_token(FieldName))
+
+@fast_path(Vary)
+def _fast_vary_or_star(data):
+    if data == b'*':
+        return (u'*', [], [])
+    return _fast_vary(data)
+
+
 fill_names(globals(), RFC(7231))
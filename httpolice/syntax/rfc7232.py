@@ -1,8 +1,10 @@
 # -*- coding: utf-8; -*-
 
+import re
+
 from httpolice.citation import RFC
-from httpolice.parse import (auto, can_complain, fill_names, maybe, octet,
-                             octet_range, pivot, string, subst)
+from httpolice.parse import (auto, can_complain, fast_path, fill_names, maybe,
+                             octet, octet_range, pivot, string, subst)
 from httpolice.structure import EntityTag
 from httpolice.syntax.common import DQUOTE
 from httpolice.syntax.rfc7230 import comma_list1, obs_text
@@ -29,4 +31,17 @@ If_None_Match = '*' | comma_list1(entity_tag)                           > pivot
 If_Modified_Since = HTTP_date                                           > pivot
 If_Unmodified_Since = HTTP_date                                         > pivot
 
+
+_entity_tag_re = re.compile(
+    b'(W/)?("[\\x21\\x23-\\x5B\\x5D-\\x7E\\x80-\\xFF]*")\\Z')
+
+@fast_path(ETag)
+def _fast_etag(data):
+    match = _entity_tag_re.match(data)
+    if match is None:
+        return None
+    (weak_, opaque) = match.groups()
+    return (EntityTag(weak_ is not None, opaque.decode('iso-8859-1')), [], [])
+
+
 fill_names(globals(), RFC(7232))
@@ -1,14 +1,17 @@
 # -*- coding: utf-8; -*-
 
 from httpolice.citation import RFC
-from httpolice.parse import (fill_names, literal, mark, maybe, maybe_str,
-                             named, pivot, skip, string1, string_times)
+from httpolice.parse import (fast_path, fill_names, literal, mark, maybe,
+                             maybe_str, named, pivot, skip, string1,
+                             string_times)
 from httpolice.structure import (CacheDirective, CaseInsensitive, Parametrized,
                                  WarnCode, WarningValue)
 from httpolice.syntax.common import DIGIT, DQUOTE, SP
-from httpolice.syntax.rfc7230 import (comma_list, comma_list1, field_name,
-                                      port, pseudonym, quoted_string, token,
-                                      token__excluding, uri_host)
+from httpolice.syntax.rfc7230 import (comma_list, comma_list1,
+                                      fast_comma_list1, field_name, port,
+                                      pseudonym, quoted_string,
+                                      quoted_string_re, token,
+                                      token__excluding, token_re, uri_host)
 from httpolice.syntax.rfc7231 import HTTP_date
 
 
@@ -46,4 +49,27 @@ warning_value = WarningValue << (warn_code * skip(SP) *
                                  maybe(skip(SP) * warn_date))           > pivot
 Warning_ = comma_list1(warning_value)                                   > pivot
 
+
+def _fast_cache_directive(s, i):
+    match = token_re.match(s, i)
+    if match is None:
+        return None
+    directive = CacheDirective(match.group())
+    annotations = [(i, match.end(), directive)]
+    (i, argument) = (match.end(), None)
+    if s[i : i + 1] == u'=':
+        match = token_re.match(s, i + 1)
+        if match is not None:
+            argument = (token, match.group())
+        else:
+            match = quoted_string_re.match(s, i + 1)
+            if match is None:
+                return None
+            argument = (quoted_string, match.group(1))
+        i = match.end()
+    return (i, Parametrized(directive, argument), annotations)
+
+fast_path(Cache_Control)(fast_comma_list1(_fast_cache_directive))
+
+
 fill_names(globals(), RFC(7234))
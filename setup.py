@@ -36,7 +36,6 @@ setup(
         'singledispatch >= 3.4.0.3',
         'six >= 1.10.0',
         'lxml >= 3.6.0',
-        'bitstring >= 3.1.4',
         'dominate >= 2.2.0',
         'defusedxml >= 0.5.0',
         'brotlipy >= 0.5.1',
@@ -56,7 +55,7 @@ setup(
         'httpolice.util',
     ],
     package_data={
-        'httpolice': ['notices.xml'],
+        'httpolice': ['notices.xml', 'grammar_cache.json'],
         'httpolice.known': ['*.csv'],
         'httpolice.reports': ['html.css', 'html.js'],
     },
@@ -0,0 +1,12 @@
+# -*- coding: utf-8; -*-
+
+import pytest
+
+import httpolice.parse
+
+
+@pytest.fixture(scope='module')
+def verify_fast_paths():
+    httpolice.parse.configure_fast_paths(verify=True)
+    yield
+    httpolice.parse.configure_fast_paths(verify=False)
@@ -1,8 +1,11 @@
 # -*- coding: utf-8; -*-
 
+import json
 import os
 
 import httpolice.cli
+import httpolice.codings
+import httpolice.parse
 from httpolice.util.text import MockStdio
 
 
@@ -129,3 +132,117 @@ def test_silence():
     assert b'1187' not in stdout
     assert b'1183' in stdout
     assert stderr == b''
+
+
+def test_memo_options():
+    try:
+        (code, stdout, stderr) = run(['-i', 'combined', '--memo-size', '10',
+                                      '--memo-per-symbol'],
+                                     ['combined_data/simple_ok',
+                                      'combined_data/1003_1'])
+        assert code == 0
+        assert b'D 1003' in stdout
+        assert stderr == b''
+        stats = httpolice.parse.memo_stats()
+        assert stats['success']['limit'] == stats['failure']['limit'] == 10
+    finally:
+        httpolice.parse.configure_memo(
+            limit=httpolice.parse.MEMO_LIMIT,
+            fail_limit=httpolice.parse.FAIL_MEMO_LIMIT,
+            per_symbol=False)
+
+
+def test_memo_file(tmpdir):
+    path = str(tmpdir.join('memo.sqlite'))
+    for _ in range(2):
+        (code, stdout, stderr) = run(['-i', 'combined', '--memo-file', path],
+                                     ['combined_data/simple_ok',
+                                      'combined_data/1003_1'])
+        assert code == 0
+        assert b'D 1003' in stdout
+        assert stderr == b''
+    assert os.path.getsize(path) > 0
+
+    (code, stdout, stderr) = run(['-i', 'combined',
+                                  '--memo-file', str(tmpdir)],
+                                 ['combined_data/simple_ok'])
+    assert code == 1
+    assert b'cannot open parse memo' in stderr
+
+
+def test_limit_options():
+    try:
+        (code, stdout, stderr) = run(['-i', 'combined',
+                                      '--max-header-length', '10',
+                                      '--max-parse-items', '100000'],
+                                     ['combined_data/simple_ok'])
+        assert code == 0
+        assert b'D 1299' in stdout
+        assert stderr == b''
+    finally:
+        httpolice.parse.configure_limits(
+            max_length=httpolice.parse.MAX_LENGTH,
+            max_items=httpolice.parse.MAX_ITEMS)
+
+
+def test_limit_without_place(tmpdir):
+    # Notice 1299 replaces notices that may not have a ``place``,
+    # like 1266 for the parameters of ``WWW-Authenticate``.
+    tmpdir.join('req').write_binary(b'GET / HTTP/1.1\r\n'
+                                    b'Host: example.com\r\n'
+                                    b'\r\n')
+    tmpdir.join('resp').write_binary(b'HTTP/1.1 401 Unauthorized\r\n'
+                                     b'WWW-Authenticate: Bearer error_uri='
+                                     b'"http://x/' + b'a/' * 200 + b'"\r\n'
+                                     b'Content-Length: 0\r\n'
+                                     b'\r\n')
+    try:
+        for output in ['text', 'html']:
+            # Enough to parse the header, but not the URI in it.
+            (code, stdout, stderr) = run(['-i', 'streams', '-o', output,
+                                          '--max-parse-items', '5000'],
+                                         [str(tmpdir.join('req')),
+                                          str(tmpdir.join('resp'))])
+            assert code == 0
+            assert b'1299' in stdout
+            assert b'too long or complex' in stdout
+            assert stderr == b''
+    finally:
+        httpolice.parse.configure_limits(max_items=httpolice.parse.MAX_ITEMS)
+
+
+def test_decoding_limit_options():
+    (code, stdout, stderr) = run(['-i', 'combined'],
+                                 ['combined_data/1300_1'])
+    assert code == 0
+    assert b'D 1300' in stdout
+    try:
+        (code, stdout, stderr) = run(['-i', 'combined',
+                                      '--max-decoded-size', '0',
+                                      '--max-decoding-ratio', '0'],
+                                     ['combined_data/1300_1'])
+        assert code == 0
+        assert b'1300' not in stdout
+        assert stderr == b''
+    finally:
+        httpolice.codings.configure_limits(
+            max_size=httpolice.codings.MAX_SIZE,
+            max_ratio=httpolice.codings.MAX_RATIO)
+
+
+def test_profile_grammar():
+    (code, stdout, stderr) = run(['-i', 'combined',
+                                  '--profile-grammar', 'text'],
+                                 ['combined_data/simple_ok'])
+    assert code == 0
+    assert stdout == b''
+    assert stderr.startswith(b'symbol ')
+    assert b'\nUser-Agent ' in stderr
+    assert httpolice.parse.profile_stats() == []
+
+    (code, stdout, stderr) = run(['-i', 'combined',
+                                  '--profile-grammar', 'json'],
+                                 ['combined_data/simple_ok'])
+    assert code == 0
+    stats = json.loads(stderr.decode('utf-8'))
+    assert u'User-Agent' in [counters['symbol'] for counters in stats]
@@ -29,6 +29,10 @@ relative_paths = [os.path.join(section, fn)
                   for fn in os.listdir(os.path.join(base_path, section))]
 
 
+# Make sure that fast paths produce the same results as the grammar.
+pytestmark = pytest.mark.usefixtures('verify_fast_paths')
+
+
 @pytest.fixture(params=relative_paths)
 def input_from_file(request):
     path = os.path.join(base_path, request.param)
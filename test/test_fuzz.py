@@ -26,6 +26,10 @@ from httpolice.structure import http2, http10, http11
 
 N_TESTS = 100
 
+
+# Make sure that fast paths produce the same results as the grammar.
+pytestmark = pytest.mark.usefixtures('verify_fast_paths')
+
 schemes = [u'http', u'https', u'foobar', None]
 versions = [http10, http11, http2, u'HTTP/3.0', None]
 methods = sorted(known.method)
@@ -1,9 +1,15 @@
 # -*- coding: utf-8; -*-
 
 import io
+import zlib
 
+import pytest
+import six
+
+import httpolice
+from httpolice.codings import decode_deflate, decode_gzip
 import httpolice.helpers
-from httpolice.known import h
+from httpolice.known import h, media
 import httpolice.notice
 import httpolice.reports.html
 
@@ -36,3 +42,40 @@ def test_notices_list():
     assert b'1151' in out
     assert b'Empty list elements in ' in out
     assert b'<var>place</var>' in out
+
+
+def test_annotated_header_entries():
+    req = httpolice.Request(u'http', u'GET', u'/', u'HTTP/1.1',
+                            [(h.accept, b'text/html;q=0.9, */*;q=0.1'),
+                             (u'X-Foo', b'bar'),
+                             (h.cache_control, b'max-age="bad')],
+                            b'')
+    httpolice.check_exchange(httpolice.Exchange(req, []))
+    assert [annotated for (_, annotated) in req.annotated_header_entries] == [
+        [media.text_html, b';q=0.9, */*;q=0.1'],
+        [b'bar'],
+        [b'max-age="bad'],
+    ]
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def test_decode_gzip():
+    text = b''.join(str(i).encode() + b'\n' for i in range(100000))
+    assert decode_gzip(_gzip(text)) == text
+    # Several members, padded with zeros.
+    assert decode_gzip(_gzip(text) + _gzip(b'foo') + b'\x00' * 10) == \
+        text + b'foo'
+    # This used to take quadratic time in the number of members.
+    members = [_gzip(str(i).encode()) for i in range(20000)]
+    assert decode_gzip(b''.join(members) + b'\x00' * 10) == \
+        b''.join(str(i).encode() for i in range(20000))
+    assert decode_gzip(b'') == b''
+    if six.PY3:             # Python 2's zlib can't tell (see `codings`).
+        with pytest.raises(zlib.error):
+            decode_gzip(_gzip(text)[:-100])
+        with pytest.raises(zlib.error):
+            decode_deflate(zlib.compress(text)[:-100])
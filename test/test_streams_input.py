@@ -1,14 +1,22 @@
 # -*- coding: utf-8; -*-
 
+import io
 import os
 
 import pytest
+import six
 
+import httpolice.framing1
+from httpolice.framing1 import (INBOUND, OUTBOUND, IncrementalParser,
+                                parse_header_fields, parse_streams)
 from httpolice.inputs import InputError
-from httpolice.inputs.streams import (combined_input, req_stream_input,
-                                      resp_stream_input, streams_input,
-                                      tcpflow_input, tcpick_input)
+from httpolice.inputs.streams import (combined_input, parse_combined,
+                                      req_stream_input, resp_stream_input,
+                                      streams_input, tcpflow_input,
+                                      tcpick_input)
 from httpolice.known import h, m, st, upgrade
+from httpolice.parse import ParseError
+from httpolice.stream import MappedStream, Stream
 from httpolice.structure import Unavailable, Versioned, http11, okay
 
 
@@ -378,3 +386,212 @@ def test_super_long_headers(tmpdir):
     exchanges = load(req_stream_input, [str(req_path)])
     assert exchanges[0].request is None
     assert [complaint.id for complaint in exchanges[0].complaints] == [1006]
+
+
+def test_mapped_body(tmpdir):
+    path = tmpdir.join('response')
+    path.write_binary(b'HTTP/1.1 200 OK\r\n'
+                      b'Content-Type: text/plain\r\n'
+                      b'Content-Length: 14\r\n'
+                      b'\r\n'
+                      b'Hello world!\r\n')
+    [exch1] = load(resp_stream_input, [str(path)])
+    [resp] = exch1.responses
+    if six.PY3:
+        assert isinstance(resp.raw_body, memoryview)
+    assert resp.decoded_body == b'Hello world!\r\n'
+    assert isinstance(resp.decoded_body, bytes)
+    assert resp.unicode_body == u'Hello world!\r\n'
+    assert resp.body == b'Hello world!\r\n'
+    assert isinstance(resp.body, bytes)
+
+
+def test_unmapped_stream():
+    data = (b'HTTP/1.1 200 OK\r\n'
+            b'Content-Length: 14\r\n'
+            b'\r\n'
+            b'Hello world!\r\n')
+    for stream in [Stream(io.BufferedReader(io.BytesIO(data))),
+                   MappedStream(data)]:
+        [exch1] = parse_streams(None, stream)
+        assert exch1.responses[0].body == b'Hello world!\r\n'
+        stream.close()
+
+
+@pytest.mark.parametrize('block', [
+    b'',
+    b'Foo: bar\r\nBaz:  qux \r\nFoo:\r\n',
+    b'Foo: bar\r\n  baz\r\n\tqux \r\nX: y\r\n',
+    b'Foo: bar\nBaz: qux\r\n',
+    b'Foo: bar\r\n  baz\n',
+    b' Foo: bar\r\n',
+    b'F\xf6o: b\xe4r\r\n',
+    b'Foo: bar\r\nBaz\r\n',
+    b'Foo: bar\r\n\rX: y\r\n',
+    b'Foo: ' + b'x' * 20000 + b'\r\n',
+])
+def test_header_fields(block):
+    # In-memory streams have a faster way to parse headers.
+    # It must work the same as the normal way.
+    data = block + b'\r\nHello world!\r\n'
+    results = []
+    for stream in [Stream(io.BufferedReader(io.BytesIO(data))),
+                   MappedStream(data)]:
+        try:
+            entries = parse_header_fields(stream)
+        except ParseError:
+            entries = None
+        results.append((entries, stream.tell(), stream.complaints))
+    assert results[0] == results[1]
+
+
+def test_empty_stream(tmpdir):
+    path = tmpdir.join('response')
+    path.write_binary(b'')
+    [exch1] = load(resp_stream_input, [str(path)])
+    assert exch1.request is None
+    assert exch1.responses == []
+
+
+def test_many_chunks(tmpdir):
+    path = tmpdir.join('response')
+    path.write_binary(b'HTTP/1.1 200 OK\r\n'
+                      b'Content-Type: text/plain\r\n'
+                      b'Transfer-Encoding: chunked\r\n'
+                      b'\r\n' +
+                      b'3\r\nabc\r\n' * 10000 +
+                      b'0\r\n'
+                      b'\r\n')
+    [exch1] = load(resp_stream_input, [str(path)])
+    [resp] = exch1.responses
+    assert resp.body == b'abc' * 10000
+    assert not resp.complaints
+
+
+def _summarize(exchanges):
+    summary = []
+    for exch in exchanges:
+        summary.append([
+            (msg.remark, msg.header_entries,
+             msg.body if isinstance(msg.body, bytes) else None,
+             sorted(notice.id for notice in msg.notices))
+            for msg in [exch.request] + exch.responses if msg is not None
+        ] + sorted(notice.id for notice in exch.notices))
+    return summary
+
+
+@pytest.mark.parametrize('piece_size', [1, 7, 1000000])
+def test_incremental_parser(piece_size):
+    # Feeding the streams bit by bit, alternating between them,
+    # must produce the same exchanges as parsing them whole.
+    data_dir = os.path.join(os.path.dirname(__file__), 'combined_data')
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        (inbound, outbound, scheme, _) = parse_combined(path)
+        expected = _summarize(parse_streams(inbound, outbound, scheme))
+
+        parser = IncrementalParser(scheme, inbound.name, outbound.name)
+        exchanges = []
+        for i in range(0, max(len(inbound.data), len(outbound.data)),
+                       piece_size):
+            exchanges.extend(parser.feed(INBOUND,
+                                         inbound.data[i : i + piece_size]))
+            exchanges.extend(parser.feed(OUTBOUND,
+                                         outbound.data[i : i + piece_size]))
+        exchanges.extend(parser.close())
+        assert _summarize(exchanges) == expected, name
+
+
+def test_incremental_parser_early():
+    parser = IncrementalParser()
+    assert parser.feed(INBOUND, b'GET / HTTP/1.1\r\n'
+                                b'Host: example.com\r\n'
+                                b'\r\n'
+                                b'GET /fav') == []
+    assert parser.feed(OUTBOUND, b'HTTP/1.1 200 OK\r\n'
+                                 b'Content-Length: 14\r\n'
+                                 b'\r\n'
+                                 b'Hello ') == []
+    [exch1] = parser.feed(OUTBOUND, b'world!\r\n')
+    assert exch1.request.target == u'/'
+    assert exch1.responses[0].body == b'Hello world!\r\n'
+    assert parser.feed(INBOUND, b'icon.ico HTTP/1.1\r\n'
+                                b'Host: example.com\r\n'
+                                b'\r\n') == []
+    [exch2] = parser.feed_eof(OUTBOUND)
+    assert exch2.request.target == u'/favicon.ico'
+    assert exch2.responses == []
+    assert parser.close() == []
+
+
+def test_incremental_parser_buffer_limit():
+    parser = IncrementalParser(max_buffer_size=100)
+    parser.feed(INBOUND, b'GET / HTTP/1.1\r\n'
+                         b'Host: example.com\r\n'
+                         b'\r\n')
+    [exch1] = parser.feed(OUTBOUND, b'HTTP/1.1 200 OK\r\n'
+                                    b'Content-Length: 1000\r\n'
+                                    b'\r\n' +
+                                    b'a' * 500)
+    assert exch1.responses == []
+    assert parser.feed(OUTBOUND, b'a' * 500) == []
+    [box] = parser.close()
+    assert [notice.id for notice in box.notices] == [1010]
+    assert box.notices[0].context['offset'] == 0
+
+
+def test_incremental_parser_event_stream(monkeypatch):
+    # Server-sent events have empty lines inside the chunks,
+    # which must not make us go over the whole body again every time.
+    calls = []
+    parse_chunk = httpolice.framing1._parse_chunk
+
+    def counting_parse_chunk(stream, data):
+        calls.append(None)
+        return parse_chunk(stream, data)
+
+    monkeypatch.setattr(httpolice.framing1, '_parse_chunk',
+                        counting_parse_chunk)
+    parser = IncrementalParser()
+    parser.feed(INBOUND, b'GET /events HTTP/1.1\r\n'
+                         b'Host: example.com\r\n'
+                         b'\r\n')
+    assert parser.feed(OUTBOUND, b'HTTP/1.1 200 OK\r\n'
+                                 b'Content-Type: text/event-stream\r\n'
+                                 b'Transfer-Encoding: chunked\r\n'
+                                 b'\r\n') == []
+    for i in range(2000):
+        event = b'data: ' + str(i).encode() + b'\n\n'
+        chunk = ('%x\r\n' % len(event)).encode() + event + b'\r\n'
+        assert parser.feed(OUTBOUND, chunk) == []
+    [exch1] = parser.feed(OUTBOUND, b'0\r\n\r\n')
+    assert exch1.responses[0].body == b''.join(
+        b'data: ' + str(i).encode() + b'\n\n' for i in range(2000))
+    assert len(calls) < 3 * 2000
+
+
+def test_incremental_parser_body_limits(monkeypatch):
+    # When a body is too long, `parse_streams` reports the message anyway,
+    # but `IncrementalParser` gives up on it when its buffer is full
+    # (as documented in ``streams.rst``).
+    monkeypatch.setattr(httpolice.framing1, 'MAX_BODY_SIZE', 100)
+    inbound = (b'POST / HTTP/1.1\r\n'
+               b'Host: example.com\r\n'
+               b'Transfer-Encoding: chunked\r\n'
+               b'\r\n' +
+               b'1\r\na\r\n' * 150 +
+               b'0\r\n'
+               b'\r\n')
+    [exch1, box] = parse_streams(MappedStream(inbound), None)
+    assert [notice.id for notice in exch1.request.notices] == [1298]
+    assert isinstance(exch1.request.body, Unavailable)
+    assert [notice.id for notice in box.notices] == [1007]
+
+    parser = IncrementalParser(max_buffer_size=100)
+    exchanges = []
+    for i in range(len(inbound)):
+        exchanges.extend(parser.feed(INBOUND, inbound[i : i + 1]))
+    exchanges.extend(parser.close())
+    [box] = exchanges
+    assert [notice.id for notice in box.notices] == [1007]
+    assert box.notices[0].context['offset'] == 0
@@ -1,18 +1,23 @@
 # -*- coding: utf-8; -*-
 
 from datetime import datetime
+import json
+import pickle
+import sqlite3
+import threading
 
 import pytest
 
 from httpolice.known import cc, media, rel, tc, unit
 import httpolice.parse
-from httpolice.parse import (ParseError, empty, literal, many, named,
-                             recursive, skip, string, subst)
-from httpolice.structure import (ContentRange, ExtValue, LanguageTag,
-                                 MultiDict, Parametrized, RangeSpecifier,
-                                 Unavailable, Versioned)
+from httpolice.parse import (ParseError, empty, literal, many, mark, named,
+                             recursive, skip, string, string_excluding, subst)
+from httpolice.structure import (ContentRange, ExtValue, FieldName,
+                                 LanguageTag, MediaType, MultiDict,
+                                 Parametrized, RangeSpecifier, Unavailable,
+                                 Versioned)
 from httpolice.syntax import (rfc3986, rfc5988, rfc6266, rfc7230, rfc7231,
-                              rfc7233)
+                              rfc7232, rfc7233, rfc7234)
 
 
 def parse(parser, text):
@@ -50,6 +55,521 @@ def test_parser_edge_cases():
     assert parse(p0, b'x') == u'x'
 
 
+def test_right_recursion():
+    p = recursive()                                    > named(u'p',
+                                                               is_pivot=True)
+    p.rec = literal('a') * p | literal('a')
+    assert parse(p, b'aaaa') == (u'a', (u'a', (u'a', u'a')))
+    # Thanks to Leo's optimization, this takes linear time.
+    with pytest.raises(ParseError) as excinfo:
+        parse(p, b'a' * 2000 + b'!')
+    assert excinfo.value.position == 2000
+    # Extracting the result still recurses once per level,
+    # so keep some headroom for tracers such as coverage.
+    expected = u'a'
+    for _ in range(299):
+        expected = (u'a', expected)
+    assert parse(p, b'a' * 300) == expected
+
+
+def test_ambiguous_grammar():
+    # These used to take exponential time to extract the results.
+    p = recursive()                                    > named(u'p')
+    p.rec = (lambda x, y: x + y) << p * p | literal('a')
+    assert parse(p, b'a' * 64) == u'a' * 64
+
+    p = recursive()                                    > named(u'p')
+    p.rec = ((lambda x, y: x + y) << literal('a') * p |
+             (lambda x, y, z: x + y + z) << literal('a') * 'a' * p |
+             literal('a'))
+    assert parse(p, b'a' * 200) == u'a' * 200
+
+
+def test_all_results():
+    # We only ever need the first result, but
+    # :func:`httpolice.parse._find_results` can enumerate all of them.
+    def all_results(symbol, data):
+        symbol = symbol.as_nonterminal()
+        memo = httpolice.parse.ChartMemo(limit=1)
+        httpolice.parse._inner_parse(data, symbol, (), charts=memo)
+        ((chart, _), end_i) = memo.find(symbol, data)
+        return [result for (_, _, result, _, _) in
+                httpolice.parse._find_results(data, symbol, chart, end_i,
+                                              [], (), from_i=0)]
+
+    p = recursive()                                    > named(u'p')
+    p.rec = p * p | rfc7230.token
+    results = all_results(p, b'abc')
+    assert len(results) == 5
+    assert set(results) == set([u'abc', (u'a', u'bc'), (u'ab', u'c'),
+                                ((u'a', u'b'), u'c'), (u'a', (u'b', u'c'))])
+
+    # The empty `p` is skipped on either side of the first or second ``a``.
+    p = recursive()                                    > named(u'p')
+    p.rec = p * 'a' * p | empty
+    assert all_results(p, b'aa') == [(u'a', u'a'), (u'a', u'a')]
+
+
+def test_parse_error():
+    p = rfc7230.comma_list1(rfc7230.token)
+    with pytest.raises(ParseError) as excinfo:
+        parse(p, b'foo, "bar"')
+    error = excinfo.value
+    assert error.position == 5
+    assert error.found == b'"'
+    assert callable(error._expected)            # Not computed until needed.
+    assert [option for (option, _) in error.expected][:2] == \
+        [u'tab or space', u'comma (,)']
+    assert error.expected is error.expected
+
+
+def test_string_excluding():
+    p = string_excluding(rfc7230.tchar, ['', 'foo', 'foobar', 'qux'])
+    for text in [b'f', b'fo', b'fooba', b'foobarx', b'Foo1', b'q', b'quux']:
+        assert parse(p, text) == text.decode('ascii')
+    for text in [b'', b'foo', b'FOO', b'foobar', b'Qux']:
+        no_parse(p, text)
+    # All the excluded strings are handled by a single automaton.
+    assert p.automaton is not None
+
+    p = many(string_excluding(rfc7230.tchar, ['', 'q']) * skip(';'))
+    assert parse(p, b'a;qq;Q1;') == [u'a', u'qq', u'Q1']
+    no_parse(p, b'a;q;')
+
+
+def test_memoized_failure():
+    p = rfc7230.comma_list1(rfc7230.token)
+    stats = httpolice.parse.memo_stats()['failure']
+    with pytest.raises(ParseError) as excinfo1:
+        parse(p, b'foo, "bar"')
+    with pytest.raises(ParseError) as excinfo2:
+        parse(p, b'foo, "bar"')
+    assert excinfo1.value is excinfo2.value
+    assert httpolice.parse.memo_stats()['failure']['hits'] == \
+        stats['hits'] + 1
+
+    complaints = []
+    def complain(notice_id, **context):
+        complaints.append((notice_id, context))
+    r = httpolice.parse.parse(b'foo, "bar"', p, complain, 1000, place=u'x')
+    assert isinstance(r, Unavailable)
+    assert complaints == [(1000, {'error': excinfo1.value, 'place': u'x'})]
+    assert httpolice.parse.memo_stats()['failure']['hits'] == \
+        stats['hits'] + 2
+
+    # The memoized error must not keep the parser's frames alive.
+    r = httpolice.parse.parse(b'foo, "baz"', p, complain, 1000)
+    error = complaints[-1][1]['error']
+    assert getattr(error, '__traceback__', None) is None
+
+
+def test_parse_many():
+    p = rfc7230.comma_list1(rfc7230.token)
+    results = httpolice.parse.parse_many(
+        [b'foo, bar', b'foo, "bar"', u'baz', b'foo, bar'], p, 1000)
+    assert results[0] == ([u'foo', u'bar'], [])
+    assert isinstance(results[1][0], Unavailable)
+    [(notice_id, context)] = results[1][1]
+    assert notice_id == 1000
+    assert isinstance(context['error'], ParseError)
+    assert results[2] == ([u'baz'], [])
+    assert results[3] is results[0]
+    with pytest.raises(ParseError):
+        httpolice.parse.parse_many([b'foo', b'"bar"'], p)
+
+    [((r, annotated), complaints)] = httpolice.parse.parse_many(
+        [b'text/html;q=0.9'], rfc7231.Accept, annotate_classes=[MediaType])
+    assert r[0].item == media.text_html
+    assert annotated == [media.text_html, b';q=0.9']
+    assert complaints == []
+
+
+def test_memo_eviction():
+    memo = httpolice.parse.Memo(limit=2)
+    memo.put(rfc7230.token, b'a', u'a')
+    memo.put(rfc7230.token, b'b', u'b')
+    assert memo.get(rfc7230.token, b'a') == u'a'
+    memo.put(rfc7230.token, b'c', u'c')
+    assert memo.get(rfc7230.token, b'b') is None        # Least recently used.
+    assert memo.get(rfc7230.token, b'a') == u'a'
+    assert memo.get(rfc7230.token, b'c') == u'c'
+    assert memo.stats == {'size': 2, 'limit': 2,
+                          'hits': 3, 'misses': 1, 'evictions': 1}
+
+    memo.configure(per_symbol=True)
+    assert len(memo) == 0
+    memo.put(rfc7230.token, b'a', u'a')
+    memo.put(rfc7230.token, b'b', u'b')
+    memo.put(rfc7230.OWS, b' ', u' ')
+    memo.put(rfc7230.token, b'c', u'c')
+    assert memo.get(rfc7230.OWS, b' ') == u' '
+    assert memo.get(rfc7230.token, b'a') is None
+    assert len(memo) == 3
+
+
+def test_chart_memo():
+    httpolice.parse.configure_memo(chart_limit=2)
+    try:
+        p = rfc7230.comma_list1(rfc7230.token)
+        assert parse(p, b'foo, bar, baz') == [u'foo', u'bar', u'baz']
+        stats = httpolice.parse.memo_stats()['chart']
+        assert parse(p, b'foo, bar, qux') == [u'foo', u'bar', u'qux']
+        assert parse(p, b'foo, bar') == [u'foo', u'bar']
+        no_parse(p, b'foo, bar, "baz"')
+        assert parse(p, b'foo, xyzzy') == [u'foo', u'xyzzy']
+        assert httpolice.parse.memo_stats()['chart']['hits'] == \
+            stats['hits'] + 4
+        assert httpolice.parse.memo_stats()['chart']['size'] == 2
+        assert parse(p, b'fo') == [u'fo']
+    finally:
+        httpolice.parse.configure_memo(
+            chart_limit=httpolice.parse.CHART_MEMO_LIMIT)
+
+    memo = httpolice.parse.ChartMemo(limit=2)
+    memo.put(rfc7230.token, b'abc', (None, 3))
+    memo.put(rfc7230.token, b'abd', (None, 3))
+    memo.put(rfc7230.token, b'xyz', (None, 3))
+    assert memo.find(rfc7230.token, b'abcd') == (None, 2)
+    assert memo.find(rfc7230.token, b'xyzzy') == (None, 3)
+    assert memo.find(rfc7230.token, b'foo') == (None, 0)
+    assert memo.find(rfc7230.qdtext, b'abc') == (None, 0)
+    memo.clear()
+    assert memo.find(rfc7230.token, b'abcd') == (None, 0)
+
+
+def test_memo_whole_values():
+    # Pieces matched by automata are parsed again, but the main memo
+    # only holds the results for whole values.
+    httpolice.parse.configure_fast_paths(enabled=False)       # Clear.
+    try:
+        misses = httpolice.parse.memo_stats()['success']['misses']
+        parse(rfc7231.Accept, b'text/html;q=0.5, */*')
+        stats = httpolice.parse.memo_stats()['success']
+        assert (stats['size'], stats['misses']) == (1, misses + 1)
+    finally:
+        httpolice.parse.configure_fast_paths(enabled=True)
+
+
+def test_memo_threads():
+    # Parse many similar values from several threads at once,
+    # with memos small enough to be churned all the time.
+    values = [(u'max-age=%d, no-cache="Set-Cookie, X-Foo%d", x' %
+               (i, i % 7)).encode('ascii') + b'y' * (i % 5)
+              for i in range(120)]
+    expected = [parse(rfc7234.Cache_Control, value) for value in values]
+    results = {}
+
+    def worker(n):
+        results[n] = [parse(rfc7234.Cache_Control, value)
+                      for value in values[n:] + values[:n]]
+
+    httpolice.parse.configure_memo(limit=20, chart_limit=10)
+    httpolice.parse.configure_fast_paths(enabled=False)
+    httpolice.parse.start_profiling()
+    try:
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(0, 120, 20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        [counters] = httpolice.parse.profile_stats()
+        assert counters['calls'] == 6 * 120
+    finally:
+        httpolice.parse.stop_profiling()
+        httpolice.parse.configure_fast_paths(enabled=True)
+        httpolice.parse.configure_memo(
+            limit=httpolice.parse.MEMO_LIMIT,
+            chart_limit=httpolice.parse.CHART_MEMO_LIMIT)
+    for n in range(0, 120, 20):
+        assert results[n] == expected[n:] + expected[:n]
+
+
+def test_share_memo():
+    shared = {}
+    httpolice.parse.share_memo(shared, limit=2)
+    try:
+        value = b'no-cache="Set-Cookie", max-age=60'
+        r = parse(rfc7234.Cache_Control, value)
+        assert len(shared) == 1
+        # Another process would find it there.
+        httpolice.parse.configure_memo()
+        stats = httpolice.parse.memo_stats()['success']
+        assert parse(rfc7234.Cache_Control, value) == r
+        assert httpolice.parse.memo_stats()['success']['hits'] == \
+            stats['hits']
+        [cached] = shared.values()
+        assert pickle.loads(cached)[0][0].param[0] is rfc7230.quoted_string
+        # Values that cannot be unpickled are parsed again.
+        [shared_key] = shared.keys()
+        shared[shared_key] = b'garbage'
+        httpolice.parse.configure_memo()
+        assert parse(rfc7234.Cache_Control, value) == r
+        # The shared memo doesn't get around the limits.
+        httpolice.parse.configure_limits(max_length=10)
+        try:
+            no_parse(rfc7234.Cache_Control, value)
+        finally:
+            httpolice.parse.configure_limits(
+                max_length=httpolice.parse.MAX_LENGTH)
+        # Anonymous symbols are not shared.
+        parse(rfc7230.comma_list(rfc7230.token), b'foo, bar')
+        assert len(shared) == 1
+        # Nor are results that cannot be pickled,
+        # such as those that contain anonymous symbols.
+        marked = mark(rfc7230.token)
+        httpolice.parse._put_shared(rfc7234.Cache_Control, (b'foo', ()),
+                                    ((marked, u'foo'), [], []))
+        assert len(shared) == 1
+        parse(rfc7234.Cache_Control, b'max-age=0')
+        parse(rfc7234.Cache_Control, b'max-age=1')
+        assert len(shared) == 2
+    finally:
+        httpolice.parse.share_memo(None)
+
+
+def test_disk_memo(tmpdir):
+    path = str(tmpdir.join('memo.sqlite'))
+    values = [b'max-age=' + str(i).encode() for i in range(30)]
+    httpolice.parse.configure_memo()            # Clear.
+    memo = httpolice.parse.DiskMemo(path)
+    httpolice.parse.share_memo(memo, limit=None)
+    try:
+        expected = [parse(rfc7234.Cache_Control, value) for value in values]
+    finally:
+        httpolice.parse.share_memo(None)
+        memo.close()
+
+    # The next run finds the results there, and doesn't need to parse them.
+    httpolice.parse.configure_memo()            # As if in a new process.
+    httpolice.parse.start_profiling()
+    memo = httpolice.parse.DiskMemo(path, max_entries=20)
+    httpolice.parse.share_memo(memo, limit=None)
+    try:
+        assert len(memo) == 30
+        assert [parse(rfc7234.Cache_Control, value)
+                for value in values[20:]] == expected[20:]
+        [counters] = httpolice.parse.profile_stats()
+        assert counters['misses'] == 0
+        # Those that were used in this run are evicted last.
+        parse(rfc7234.Cache_Control, b'no-cache')
+        assert len(memo) == 18
+        for value in values[20:]:
+            assert memo.get((u'httpolice.syntax.rfc7234:Cache_Control',
+                             value, ())) is not None
+        assert memo.get((u'httpolice.syntax.rfc7234:Cache_Control',
+                         values[0], ())) is None
+    finally:
+        httpolice.parse.stop_profiling()
+        httpolice.parse.share_memo(None)
+        memo.close()
+
+    # Results from other versions of HTTPolice are discarded.
+    db = sqlite3.connect(path)
+    [(version,)] = db.execute(u'SELECT version FROM meta').fetchall()
+    assert version.startswith(httpolice.__version__ + u'-')
+    db.execute(u"UPDATE meta SET version = 'foo'")
+    db.commit()
+    db.close()
+    memo = httpolice.parse.DiskMemo(path)
+    assert len(memo) == 0
+    # Results are written out every once in a while, not only on close.
+    for i in range(1000):
+        memo[(u'foo', str(i).encode(), ())] = b'baz'
+    db = sqlite3.connect(path)
+    assert db.execute(u'SELECT COUNT(*) FROM results').fetchone() == (1000,)
+    db.close()
+    memo.close()
+    # Any errors after the file has been opened are ignored.
+    assert memo.get((u'foo', b'bar', ())) is None
+    memo[(u'foo', b'bar', ())] = b'baz'
+    memo.close()
+
+    tmpdir.join('bad.sqlite').write(b'This is not a database.' * 100)
+    with pytest.raises(IOError):
+        httpolice.parse.DiskMemo(str(tmpdir.join('bad.sqlite')))
+
+
+def test_disk_memo_grammar_unreadable(tmpdir, monkeypatch):
+    def fail():
+        raise IOError('no grammar here')
+    monkeypatch.setattr(httpolice.parse, '_grammar_hash', fail)
+    with pytest.raises(IOError) as excinfo:
+        httpolice.parse.DiskMemo(str(tmpdir.join('memo.sqlite')))
+    assert u'cannot open parse memo' in str(excinfo.value)
+
+
+def test_profiling():
+    httpolice.parse.start_profiling()
+    try:
+        parse(rfc7230.Trailer, b'close, upgrade')
+        parse(rfc7230.Trailer, b'close, upgrade')
+        no_parse(rfc7230.Trailer, b'close upgrade')
+        parse(rfc7230.token | rfc7230.quoted_string, b'foo')
+        [stats1, stats2] = sorted(httpolice.parse.profile_stats(),
+                                  key=lambda counters: counters['symbol'])
+    finally:
+        httpolice.parse.stop_profiling()
+    assert stats1['symbol'] == u'Trailer'
+    assert stats1['calls'] == 3
+    assert stats1['hits'] == 1
+    assert stats1['misses'] == 2
+    assert stats1['bytes'] == 41
+    assert stats1['items'] > 0
+    assert stats1['steps'] > 0
+    assert stats1['time'] > 0
+    assert stats2['symbol'] == u'token | quoted-string'
+    assert httpolice.parse.profile_stats() == []
+
+
+def test_fast_paths():
+    values = [
+        (rfc7230.Content_Length, b'1234'),
+        (rfc7230.Connection, b'close, Upgrade'),
+        (rfc7230.Transfer_Encoding, b'Gzip, chunked'),
+        (rfc7231.Content_Type, b'text/html ; charset="utf-8"'),
+        (rfc7231.Date, b'Sun, 06 Nov 1994 08:49:37 GMT'),
+        (rfc7231.Vary, b'*'),
+        (rfc7231.Vary, b'Accept-Encoding,User-Agent'),
+        (rfc7232.ETag, b'W/"xyzzy"'),
+        (rfc7234.Cache_Control, b'max-age=3600, no-cache="Set-Cookie"'),
+    ]
+    httpolice.parse.configure_fast_paths(verify=True)
+    try:
+        for (symbol, value) in values:
+            assert httpolice.parse._fast_paths[symbol](value) is not None
+            httpolice.parse.parse(value, symbol,
+                                  annotate_classes=[MediaType, FieldName])
+        # Inputs that are not simple enough still go to the grammar.
+        assert parse(rfc7231.Date, b'Sunday, 06-Nov-94 08:49:37 GMT') == \
+            datetime(1994, 11, 6, 8, 49, 37)
+        no_parse(rfc7230.Content_Length, b'12 34')
+        for value in [b'text', b'text/', b'text/html;']:
+            assert httpolice.parse._fast_paths[rfc7231.Content_Type](value) \
+                is None
+        # DEL is not allowed in entity tags.
+        assert httpolice.parse._fast_paths[rfc7232.ETag](b'"abc\x7fdef"') \
+            is None
+        no_parse(rfc7232.ETag, b'"abc\x7fdef"')
+
+        fast_content_length = \
+            httpolice.parse._fast_paths[rfc7230.Content_Length]
+        httpolice.parse._fast_paths[rfc7230.Content_Length] = \
+            lambda data: (int(data) + 1, [], [])
+        with pytest.raises(AssertionError):
+            parse(rfc7230.Content_Length, b'1234')
+        httpolice.parse._fast_paths[rfc7230.Content_Length] = \
+            lambda data: (0, [], [])
+        with pytest.raises(AssertionError):
+            parse(rfc7230.Content_Length, b'1234x')
+        httpolice.parse._fast_paths[rfc7230.Content_Length] = \
+            fast_content_length
+    finally:
+        httpolice.parse.configure_fast_paths(verify=False)
+
+    httpolice.parse.configure_fast_paths(enabled=False)
+    try:
+        assert parse(rfc7230.Content_Length, b'1234') == 1234
+    finally:
+        httpolice.parse.configure_fast_paths(enabled=True)
+
+
+def test_limits():
+    httpolice.parse.configure_limits(max_length=10)
+    try:
+        assert parse(rfc7230.Connection, b'close, foo') == [u'close', u'foo']
+        with pytest.raises(httpolice.parse.ParseLimitError):
+            parse(rfc7230.Connection, b'close, foo1')
+        complaints = []
+        r = httpolice.parse.parse(b'close, foo1', rfc7230.Connection,
+                                  lambda id_, **ctx: complaints.append(id_),
+                                  1000)
+        assert isinstance(r, Unavailable)
+        assert complaints == [1299]
+    finally:
+        httpolice.parse.configure_limits(max_length=httpolice.parse.MAX_LENGTH)
+
+    httpolice.parse.configure_limits(max_items=1000)
+    try:
+        assert parse(rfc7231.Accept, b'text/html')[0].item.item == \
+            MediaType(u'text/html')
+        with pytest.raises(httpolice.parse.ParseLimitError):
+            parse(rfc7231.Accept, b', '.join([b'text/html'] * 100))
+    finally:
+        httpolice.parse.configure_limits(max_items=httpolice.parse.MAX_ITEMS)
+
+    with pytest.raises(httpolice.parse.ParseLimitError):
+        parse(rfc7231.User_Agent, b'demo (' + b'(' * 5000 + b')' * 5001)
+
+
+def test_max_items_with_prefix():
+    # Whether a value fits into `max_items` must not depend on whether
+    # the parser resumes from a prefix parsed before (see `ChartMemo`).
+    value = b', '.join([b'text/html'] * 20)
+
+    def fits(max_items):
+        httpolice.parse.configure_limits(max_items=max_items)
+        httpolice.parse.configure_memo()
+        try:
+            parse(rfc7231.Accept, value)
+        except httpolice.parse.ParseLimitError:
+            return False
+        return True
+
+    httpolice.parse.configure_fast_paths(enabled=False)
+    try:
+        (low, high) = (1, 100000)
+        while low < high:
+            mid = (low + high) // 2
+            if fits(mid):
+                high = mid
+            else:
+                low = mid + 1
+        assert not fits(low - 1)
+        httpolice.parse.configure_limits(max_items=low - 1)     # Clear.
+        assert parse(rfc7231.Accept, value[:-11])
+        with pytest.raises(httpolice.parse.ParseLimitError):
+            parse(rfc7231.Accept, value)
+        assert httpolice.parse.memo_stats()['chart']['hits'] > 0
+
+        # Charts saved under a looser limit are not resumed.
+        httpolice.parse.configure_limits(max_items=0)
+        assert parse(rfc7231.Accept, value[:-11])
+        httpolice.parse.configure_limits(max_items=low - 1)
+        assert httpolice.parse.memo_stats()['chart']['size'] == 0
+        with pytest.raises(httpolice.parse.ParseLimitError):
+            parse(rfc7231.Accept, value)
+
+        # Finding out what was expected takes more items than parsing.
+        # When that exceeds the limit, we just don't know.
+        httpolice.parse.configure_limits(max_items=low + 100)
+        with pytest.raises(ParseError) as excinfo:
+            parse(rfc7231.Accept, value + b' "')
+        assert not isinstance(excinfo.value,
+                              httpolice.parse.ParseLimitError)
+        assert excinfo.value.expected == []
+    finally:
+        httpolice.parse.configure_fast_paths(enabled=True)
+        httpolice.parse.configure_limits(max_items=httpolice.parse.MAX_ITEMS)
+
+
+def test_grammar_cache(tmpdir):
+    path = str(tmpdir.join('grammar_cache.json'))
+    httpolice.parse.save_grammar_cache(path)
+    cache = httpolice.parse.load_grammar_cache(path)
+    assert cache[u'httpolice.syntax.rfc7230:token'] is True
+    assert cache[u'httpolice.syntax.rfc7230:Host'] is False
+    # If this fails, run ``tools/grammar_cache.py``.
+    assert httpolice.parse.load_grammar_cache(
+        httpolice.parse.GRAMMAR_CACHE_PATH) == cache
+    assert httpolice.parse.load_grammar_cache(path + '.missing') == {}
+    # A cache made for another version of the grammar is ignored.
+    with open(path, 'wb') as f:
+        f.write(json.dumps({u'hash': u'0' * 40,
+                            u'automata': cache}).encode('utf-8'))
+    assert httpolice.parse.load_grammar_cache(path) == {}
+
+
 def test_comma_list():
     p = rfc7230.comma_list(rfc7230.token)
     assert parse(p, b'') == []
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+"""Tool to regenerate the grammar cache (``httpolice/grammar_cache.json``).
+
+Run it after changing :mod:`httpolice.syntax` or :mod:`httpolice.parse`
+(``test_grammar_cache`` will remind you).
+"""
+
+import httpolice.parse
+
+
+def main():
+    httpolice.parse.save_grammar_cache(httpolice.parse.GRAMMAR_CACHE_PATH)
+
+if __name__ == '__main__':
+    main()
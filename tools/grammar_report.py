@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+"""Tool to find ambiguous and expensive rules in :mod:`httpolice.syntax`.
+
+Simply run::
+
+  $ tools/grammar_report.py
+
+or, to look at some headers only::
+
+  $ tools/grammar_report.py Accept Cache-Control
+
+For every header that has a syntax in ``httpolice/known/header.csv``,
+this generates random values from the header's grammar, parses them,
+and reports:
+
+- how many Earley items were created per byte of input (``items/B``),
+  and how many steps :func:`httpolice.parse._find_results` took;
+- for list headers, how ``items/B`` changes when many of these values
+  are joined into one long list (``growth``, which should stay close to 1;
+  anything much bigger means the grammar is not linear-time in practice);
+- how many generated values had more than one derivation (``ambig``),
+  and which symbols were ambiguous, with an example;
+- which rules account for the most items, across all headers.
+
+Ambiguity is not a bug in itself (the parser just takes the first
+derivation), but it makes :func:`httpolice.parse._find_results`
+explore alternatives, and often means that a rule can be simplified.
+
+The values are random but reproducible (see ``--seed``).
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+import random
+import sys
+
+from httpolice import known, parse
+from httpolice.known import HeaderRule
+from httpolice.structure import FieldName
+
+# pylint: disable=protected-access
+
+
+# Cap on the number of derivations counted, to keep the numbers printable.
+MAX_DERIVATIONS = 10 ** 6
+
+
+class Generator(object):
+
+    """Generates random strings from a grammar symbol."""
+
+    def __init__(self, rng, max_depth):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.min_length = {}
+
+    def generate(self, symbol):
+        self._compute_min_lengths(symbol)
+        out = []
+        self._generate(symbol, 0, out)
+        return b''.join(out)
+
+    def _generate(self, symbol, depth, out):
+        if isinstance(symbol, parse.Terminal):
+            out.append(self.rng.choice(symbol.chars()))
+            return
+        rules = [rule for rule in symbol.rules
+                 if self._rule_length(rule) is not None]
+        if depth >= self.max_depth:
+            # Wrap up as soon as possible.
+            shortest = min(self._rule_length(rule) for rule in rules)
+            rules = [rule for rule in rules
+                     if self._rule_length(rule) == shortest]
+        for next_symbol in self.rng.choice(rules).symbols:
+            self._generate(next_symbol, depth + 1, out)
+
+    def _rule_length(self, rule):
+        total = 0
+        for symbol in rule.symbols:
+            if isinstance(symbol, parse.Terminal):
+                total += 1
+            elif self.min_length.get(symbol) is None:
+                return None
+            else:
+                total += self.min_length[symbol]
+        return total
+
+    def _compute_min_lengths(self, target_symbol):
+        if target_symbol in self.min_length:
+            return
+        symbols = []
+        stack = [target_symbol]
+        seen = set(stack)
+        while stack:
+            symbol = stack.pop()
+            symbols.append(symbol)
+            self.min_length.setdefault(symbol, None)
+            for rule in symbol.rules:
+                for next_symbol in rule.symbols:
+                    if isinstance(next_symbol, parse.Nonterminal) and \
+                            next_symbol not in seen:
+                        seen.add(next_symbol)
+                        stack.append(next_symbol)
+        changed = True
+        while changed:
+            changed = False
+            for symbol in symbols:
+                lengths = [self._rule_length(rule) for rule in symbol.rules]
+                lengths = [n for n in lengths if n is not None]
+                if lengths and (self.min_length[symbol] is None or
+                                min(lengths) < self.min_length[symbol]):
+                    self.min_length[symbol] = min(lengths)
+                    changed = True
+
+
+class KeepChart(object):
+
+    """Stands in for a :class:`httpolice.parse.ChartMemo` to grab the chart."""
+
+    chart = None
+
+    def find(self, symbol, data):           # pylint: disable=unused-argument
+        return (None, 0)
+
+    def put(self, symbol, data, value):     # pylint: disable=unused-argument
+        ((self.chart, _), _) = value
+
+
+class Forest(object):
+
+    """Counts the derivations of a value in a chart built without automata.
+
+    A derivation of a nonterminal from `start` to `end` is a choice
+    of one of its rules, plus a split of the input among that rule's symbols,
+    plus derivations for those symbols.
+    The chart contains everything needed to enumerate these choices.
+    """
+
+    def __init__(self, data, chart):
+        self.data = bytearray(data)
+        self.chart = chart
+        # For every `i`, the completed items by symbol and start.
+        self.completed = []
+        for i in range(len(chart)):
+            parse._materialize_leo(chart, i)
+            by_symbol = defaultdict(lambda: defaultdict(list))
+            for item in chart[i][1].get(None, []):
+                dot = item & parse._DOT_MASK
+                by_symbol[parse._dot_symbol[dot]][item >> parse._DOT_BITS]. \
+                    append(dot)
+            self.completed.append(by_symbol)
+        self._counts = {}
+        self._prefixes = {}
+
+    def count(self, symbol, start, end):
+        """The number of derivations of `symbol` from `start` to `end`."""
+        if isinstance(symbol, parse.Terminal):
+            return int(end == start + 1 and
+                       bool(symbol.table[self.data[start]]))
+        key = (symbol, start, end)
+        if key not in self._counts:
+            self._counts[key] = 0           # Break cycles of unit rules.
+            total = 0
+            for dot in self.completed[end][symbol].get(start, []):
+                rule = parse._dot_rule[dot]
+                n = len(rule.symbols)
+                (trees, _) = self._prefix(start, dot - n, n, end)
+                total += trees
+            self._counts[key] = min(total, MAX_DERIVATIONS)
+        return self._counts[key]
+
+    def alternatives(self, symbol, start, end):
+        """The rules and splits by which `symbol` spans `start` to `end`.
+
+        Return a list of pairs: a completed dot and the number of splits.
+        """
+        r = []
+        for dot in self.completed[end][symbol].get(start, []):
+            n = len(parse._dot_rule[dot].symbols)
+            (_, splits) = self._prefix(start, dot - n, n, end)
+            if splits:
+                r.append((dot, splits))
+        return r
+
+    def steps(self, start, first_dot, k, end):
+        """Ways to extend the first `k - 1` symbols of a rule to the `k`th.
+
+        Yield triples: the position `mid` where the `k`th symbol begins,
+        that symbol, and the number of its derivations from `mid` to `end`.
+        """
+        symbol = parse._dot_rule[first_dot].symbols[k - 1]
+        prev_item = (start << parse._DOT_BITS) | (first_dot + k - 1)
+        if isinstance(symbol, parse.Terminal):
+            mids = [end - 1] if end > start else []
+        else:
+            mids = [mid for mid in self.completed[end][symbol]
+                    if start <= mid <= end]
+        for mid in mids:
+            if prev_item in self.chart[mid][2]:
+                n = self.count(symbol, mid, end)
+                if n:
+                    yield (mid, symbol, n)
+
+    def _prefix(self, start, first_dot, k, end):
+        # The numbers of derivations and of splits
+        # for the first `k` symbols of a rule from `start` to `end`.
+        if k == 0:
+            return (int(start == end), int(start == end))
+        key = (start, first_dot, k, end)
+        if key not in self._prefixes:
+            self._prefixes[key] = (0, 0)
+            (trees, splits) = (0, 0)
+            for (mid, _, n) in self.steps(start, first_dot, k, end):
+                (trees1, splits1) = self._prefix(start, first_dot, k - 1, mid)
+                trees += trees1 * n
+                splits += splits1
+            self._prefixes[key] = (min(trees, MAX_DERIVATIONS),
+                                   min(splits, MAX_DERIVATIONS))
+        return self._prefixes[key]
+
+    def ambiguities(self, symbol):
+        """Find the places where a derivation of the whole input can branch.
+
+        Yield triples: the symbol, its start, and its alternatives
+        (see :meth:`alternatives`).
+        """
+        end = len(self.data)
+        stack = [(symbol, 0, end)]
+        seen = set(stack)
+        while stack:
+            (symbol, start, end) = stack.pop()
+            alternatives = self.alternatives(symbol, start, end)
+            if len(alternatives) > 1 or \
+                    any(splits > 1 for (_, splits) in alternatives):
+                yield (symbol, start, end, alternatives)
+            prefixes = [(dot - len(parse._dot_rule[dot].symbols),
+                         len(parse._dot_rule[dot].symbols), end)
+                        for (dot, _) in alternatives]
+            seen_prefixes = set(prefixes)
+            while prefixes:
+                (first_dot, k, prefix_end) = prefixes.pop()
+                if k == 0:
+                    continue
+                for (mid, child, _) in self.steps(start, first_dot, k,
+                                                  prefix_end):
+                    (trees, _) = self._prefix(start, first_dot, k - 1, mid)
+                    if not trees:
+                        continue
+                    if isinstance(child, parse.Nonterminal) and \
+                            (child, mid, prefix_end) not in seen:
+                        seen.add((child, mid, prefix_end))
+                        stack.append((child, mid, prefix_end))
+                    if (first_dot, k - 1, mid) not in seen_prefixes:
+                        seen_prefixes.add((first_dot, k - 1, mid))
+                        prefixes.append((first_dot, k - 1, mid))
+
+
+# The nearest named symbol (or header) in which every anonymous symbol occurs.
+owners = {}
+
+
+def find_owners(symbol, owner):
+    stack = [(symbol, owner)]
+    seen = set()
+    while stack:
+        (symbol, owner) = stack.pop()
+        if symbol in seen or symbol in owners:
+            continue
+        seen.add(symbol)
+        if symbol.name is None:
+            owners[symbol] = owner
+        else:
+            owner = symbol.name
+        for rule in symbol.rules:
+            for next_symbol in rule.symbols:
+                if isinstance(next_symbol, parse.Nonterminal):
+                    stack.append((next_symbol, owner))
+
+
+def describe_symbol(symbol, depth=2):
+    """A short ABNF-like description of `symbol`."""
+    if symbol.name is not None:
+        return u'%s' % symbol.name
+    if isinstance(symbol, parse.Terminal):
+        chars = symbol.chars()
+        if len(set(char.lower() for char in chars)) == 1:
+            return u'"%s"' % chars[0].decode('iso-8859-1').lower()
+        return u'%%x(%d octets)' % len(chars)
+    if depth == 0:
+        return u'...'
+    if isinstance(symbol, parse.RepeatedNonterminal):
+        return u'%s(%s)' % (u'*' if symbol.max_count is None
+                            else u'*%d' % symbol.max_count,
+                            describe_symbol(symbol.inner.as_nonterminal(),
+                                            depth - 1))
+    return u' / '.join(describe_symbols(rule.symbols, depth - 1)
+                       for rule in symbol.rules)
+
+
+def describe_symbols(symbols, depth=2):
+    parts = []
+    for symbol in symbols:
+        part = describe_symbol(symbol, depth)
+        if u' ' in part and not part.startswith(u'*'):
+            part = u'(%s)' % part
+        if parts and part.startswith(u'"') and parts[-1].startswith(u'"') \
+                and part.endswith(u'"') and parts[-1].endswith(u'"'):
+            # Merge terminals that make up a literal string.
+            parts[-1] = parts[-1][:-1] + part[1:]
+        else:
+            parts.append(part)
+    return u' '.join(parts) or u'""'
+
+
+def describe_lhs(symbol):
+    if symbol.name is None:
+        return u'(part of %s)' % owners.get(symbol, u'?')
+    return u'%s' % symbol.name
+
+
+def describe_rule(symbol, rule):
+    if rule is None:
+        return u'%s (automaton)' % describe_lhs(symbol)
+    return u'%s = %s' % (describe_lhs(symbol), describe_symbols(rule.symbols))
+
+
+class Measurement(object):
+
+    """The cost of parsing one value, with and without automata."""
+
+    def __init__(self, data, symbol, check_ambiguity=True):
+        self.data = data
+        self.length = len(data)
+        self.items_by_rule = defaultdict(int)
+        self.ambiguities = []
+        self.derivations = None
+
+        parse._memo.clear()
+        keep = KeepChart()
+        steps = parse._profiler.running.steps
+        parse._inner_parse(data, symbol, (), charts=keep)
+        self.steps = parse._profiler.running.steps - steps
+        self.items = 0
+        for column in keep.chart:
+            self.items += len(column[0])
+            for item in column[0]:
+                dot = item & parse._DOT_MASK
+                self.items_by_rule[(parse._dot_symbol[dot],
+                                    parse._dot_rule[dot])] += 1
+
+        if check_ambiguity:
+            keep = KeepChart()
+            parse._inner_parse(data, symbol, (), plain=True, charts=keep)
+            forest = Forest(data, keep.chart)
+            self.derivations = forest.count(symbol, 0, len(data))
+            self.ambiguities = list(forest.ambiguities(symbol))
+
+    @property
+    def items_per_byte(self):
+        return float(self.items) / max(self.length, 1)
+
+
+class HeaderReport(object):
+
+    def __init__(self, name, symbol, rule):
+        self.name = name
+        self.symbol = symbol
+        self.rule = rule
+        self.values = []
+        self.failures = []
+        self.measurements = []
+        self.growth = None
+        # Ambiguous symbol -> (number of values, example).
+        self.ambiguous = {}
+
+    def run(self, generator, n_samples):
+        for _ in range(n_samples):
+            data = generator.generate(self.symbol)
+            try:
+                measurement = Measurement(data, self.symbol)
+            except Exception as e:          # pylint: disable=broad-except
+                self.failures.append((data, e))
+                continue
+            self.values.append(data)
+            self.measurements.append(measurement)
+            for (symbol, start, end, alternatives) in \
+                    measurement.ambiguities:
+                (count, example) = self.ambiguous.get(symbol, (0, None))
+                if example is None:
+                    example = (data[start:end],
+                               [(describe_rule(symbol, parse._dot_rule[dot]),
+                                 splits)
+                                for (dot, splits) in alternatives])
+                self.ambiguous[symbol] = (count + 1, example)
+
+        # Values of list headers can be joined into a longer value,
+        # which is what we sometimes get in real life
+        # (see :mod:`httpolice.header`).
+        nonempty = [data for data in self.values if data.strip()]
+        if self.rule is HeaderRule.multi and nonempty:
+            joined = b', '.join(nonempty * 10)
+            try:
+                long_measurement = Measurement(joined, self.symbol,
+                                               check_ambiguity=False)
+            except Exception:               # pylint: disable=broad-except
+                pass
+            else:
+                short = [m for m in self.measurements if m.data.strip()]
+                average = (float(sum(m.items for m in short)) /
+                           max(sum(m.length for m in short), 1))
+                self.growth = long_measurement.items_per_byte / average
+
+    @property
+    def n_ambiguous(self):
+        return sum(1 for m in self.measurements if m.derivations != 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=u'Report ambiguity and parsing cost of header grammars.')
+    parser.add_argument(u'headers', metavar=u'HEADER', nargs=u'*',
+                        help=u'header names (default: all with a syntax)')
+    parser.add_argument(u'--samples', type=int, default=50, metavar=u'N',
+                        help=u'values to generate per header (default: 50)')
+    parser.add_argument(u'--depth', type=int, default=12, metavar=u'N',
+                        help=u'limit on the depth of generated derivations '
+                             u'(default: 12)')
+    parser.add_argument(u'--seed', type=int, default=0,
+                        help=u'random seed (default: 0)')
+    parser.add_argument(u'--top', type=int, default=20, metavar=u'N',
+                        help=u'how many of the most expensive rules to show '
+                             u'(default: 20)')
+    args = parser.parse_args()
+
+    # Derivations of long lists are counted recursively.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    parse.start_profiling()         # For counting `_find_results` steps.
+
+    if args.headers:
+        names = [FieldName(name) for name in args.headers]
+    else:
+        names = sorted(name for name in known.header
+                       if known.header.syntax_for(name) is not None)
+    generator = Generator(random.Random(args.seed), args.depth)
+    reports = []
+    for name in names:
+        symbol = known.header.syntax_for(name)
+        if symbol is None:
+            print(u'%s: no syntax, skipping' % name, file=sys.stderr)
+            continue
+        find_owners(symbol, name)
+        report = HeaderReport(name, symbol,
+                              known.header.get(name).get('rule'))
+        report.run(generator, args.samples)
+        reports.append(report)
+
+    print(u'%-32s%8s%8s%10s%10s%10s%8s' % (u'header', u'values', u'failed',
+                                          u'items/B', u'steps/B', u'growth',
+                                          u'ambig'))
+    for report in reports:
+        n_bytes = max(sum(m.length for m in report.measurements), 1)
+        print(u'%-32s%8d%8d%10.1f%10.1f%10s%8d' % (
+            report.name, len(report.measurements), len(report.failures),
+            float(sum(m.items for m in report.measurements)) / n_bytes,
+            float(sum(m.steps for m in report.measurements)) / n_bytes,
+            u'-' if report.growth is None else u'%.2f' % report.growth,
+            report.n_ambiguous))
+
+    print()
+    print(u'Ambiguous symbols')
+    print(u'-----------------')
+    for report in reports:
+        for (symbol, (count, (example, alternatives))) in \
+                sorted(report.ambiguous.items(),
+                       key=lambda entry: -entry[1][0]):
+            print(u'%s: %s is ambiguous in %d value%s, for example %r:' %
+                  (report.name, describe_lhs(symbol), count,
+                   u'' if count == 1 else u's', example))
+            for (rule, splits) in alternatives:
+                print(u'    %s (%d way%s)' %
+                      (rule, splits, u'' if splits == 1 else u's'))
+
+    print()
+    print(u'Failed values')
+    print(u'-------------')
+    for report in reports:
+        for (data, exc) in report.failures[:3]:
+            print(u'%s: %r: %s' % (report.name, data, exc))
+
+    print()
+    print(u'Most expensive rules')
+    print(u'--------------------')
+    totals = defaultdict(int)
+    for report in reports:
+        for measurement in report.measurements:
+            for (key, n) in measurement.items_by_rule.items():
+                totals[key] += n
+    for ((symbol, rule), n) in sorted(totals.items(),
+                                      key=lambda entry: -entry[1])[:args.top]:
+        print(u'%10d  %s' % (n, describe_rule(symbol, rule)))
+
+
+if __name__ == '__main__':
+    main()